@@ -0,0 +1,121 @@
+"""
+Regression check: every in-memory KPI engine must give the same KPIs as the original
+pandas implementation (pandas_analysis.compute_in_memory_kpis).
+
+Generates a synthetic dataset, runs each engine on it and compares every KPI with the
+reference. Exits with code 1 if any KPI differs, so it can run before a release or in CI.
+
+    vectorized   kpi_engine.compute_kpis_vectorized
+    partitioned  order_partitions.compute_kpis_from_frames
+    sharded      kpi_sharded.compute_kpis_sharded (forced onto several processes)
+    chunked      kpi_partial.KpiPartialState, streamed from the XML
+
+    python -m benchmarks.check_kpi_engines --customers 5000 --orders 50000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+from benchmarks.generate_data import generate_dataset
+
+# Shards for the sharded engine; at least 2, so the multi-process path is what gets checked
+CHECK_SHARDS = 3
+
+# Relative tolerance for revenue sums (the engines add the same amounts in a different order)
+SUM_RTOL = 1e-9
+
+
+def _normalized(kpi_df):
+    # Engines may differ in index and dtypes (e.g. categorical vs object names), not in rows or their order
+    kpi_df = kpi_df.reset_index() if kpi_df.index.name is not None else kpi_df.reset_index(drop=True)
+    kpi_df = kpi_df.astype({column: str for column in kpi_df.columns if kpi_df[column].dtype.kind in 'OU'
+                            or isinstance(kpi_df[column].dtype, pd.CategoricalDtype)})
+    return kpi_df
+
+
+def compare_kpis(expected, actual):
+    """
+    Returns {kpi_name: error message} for every KPI of 'actual' that differs from 'expected'.
+    """
+    errors = {}
+    for kpi_name, expected_df in expected.items():
+        try:
+            pd.testing.assert_frame_equal(
+                _normalized(expected_df), _normalized(actual[kpi_name]),
+                check_dtype=False, check_categorical=False, rtol=SUM_RTOL
+            )
+        except AssertionError as e:
+            errors[kpi_name] = str(e).strip().splitlines()[0]
+    return errors
+
+
+def run_engines(customer_file, order_file, chunk_size):
+    """
+    Extracts the dataset once and returns (reference KPIs, {engine: KPIs}).
+    """
+    from pipeline.data_processor import load_and_clean_data, read_customers
+    from pipeline.kpi_engine import compute_kpis_vectorized
+    from pipeline.kpi_partial import compute_partial_state
+    from pipeline.kpi_sharded import compute_kpis_sharded
+    from pipeline.order_partitions import compute_kpis_from_frames
+    from pipeline.pandas_analysis import compute_in_memory_kpis, thirty_days_before
+
+    since = thirty_days_before()
+    with contextlib.redirect_stdout(io.StringIO()):
+        customers_df, unique_orders_df, _ = load_and_clean_data(customer_file, order_file, use_cache=False)
+        raw_customers_df, _ = read_customers(customer_file)
+
+    reference = compute_in_memory_kpis(customers_df, unique_orders_df, since)
+    engines = {
+        'vectorized': lambda: compute_kpis_vectorized(customers_df, unique_orders_df, since),
+        'partitioned': lambda: compute_kpis_from_frames(customers_df, unique_orders_df, since),
+        'sharded': lambda: compute_kpis_sharded(
+            customers_df, unique_orders_df, since, n_shards=CHECK_SHARDS, min_orders_per_shard=1
+        ),
+        # Joins on mobile_number itself, before any surrogate keys
+        'chunked': lambda: compute_partial_state(
+            order_file, since, raw_customers_df['mobile_number'], chunk_size
+        ).finalize(raw_customers_df),
+    }
+    return reference, {name: engine() for name, engine in engines.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every in-memory KPI engine matches the pandas one.")
+    parser.add_argument('--customers', type=int, default=2_000)
+    parser.add_argument('--orders', type=int, default=20_000)
+    parser.add_argument('--customer-skew', type=float, default=1.0)
+    parser.add_argument('--chunk-size', type=int, default=7_919,
+                        help="order items per chunk for the chunked engine (odd, so orders straddle chunks)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Synthetic ids must not end up in the real surrogate key store
+        os.environ['PIPELINE_KEY_STORE'] = os.path.join(work_dir, 'surrogate_keys')
+        os.environ['PIPELINE_QUARANTINE_DIR'] = os.path.join(work_dir, 'quarantine')
+        # Orders up to today, so the 30-day window of KPI 4 is not empty
+        today = pd.Timestamp.today().normalize()
+        customer_file, order_file = generate_dataset(
+            work_dir, args.customers, args.orders, seed=args.seed, customer_skew=args.customer_skew,
+            start=str((today - pd.DateOffset(years=1)).date()), end=str(today.date())
+        )
+        reference, results = run_engines(customer_file, order_file, args.chunk_size)
+
+    failed = False
+    for engine, kpis in results.items():
+        errors = compare_kpis(reference, kpis)
+        failed = failed or bool(errors)
+        print(f"{engine:>12}: {'OK' if not errors else 'MISMATCH'}")
+        for kpi_name, message in errors.items():
+            print(f"{'':>14}{kpi_name}: {message}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Synthetic data generator for scaling tests.
+
+Writes a customers CSV and an orders XML in the same format as the files in data/,
+at any scale. Order volume per customer is skewed (a few customers place most of the
+orders), orders have several SKUs, and order dates are spread over a date range.
+
+    python -m benchmarks.generate_data --customers 100000 --orders 2000000 --out data/synthetic
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+REGION_WEIGHTS = [0.25, 0.2, 0.15, 0.3, 0.1]
+
+# Orders are written in blocks, so memory stays flat however many orders we generate
+WRITE_BLOCK_SIZE = 100_000
+
+
+def generate_customers(n_customers, seed=0):
+    """
+    Returns a customers DataFrame with unique mobile numbers.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_customers + 1)
+    return pd.DataFrame({
+        'customer_id': [f"CUST-{i:07d}" for i in ids],
+        'customer_name': [f"Customer {i}" for i in ids],
+        'mobile_number': 9000000000 + ids,
+        'region': rng.choice(REGIONS, size=n_customers, p=REGION_WEIGHTS),
+    })
+
+
+def _skewed_choice(rng, n_values, size, skew):
+    """
+    Picks indexes in [0, n_values) with a Zipf-like skew: index 0 is the most frequent.
+    skew=0 gives a uniform pick; higher values concentrate the picks on fewer values.
+    """
+    if skew <= 0:
+        return rng.integers(0, n_values, size=size)
+    weights = 1.0 / np.arange(1, n_values + 1) ** skew
+    return rng.choice(n_values, size=size, p=weights / weights.sum())
+
+
+def write_orders_xml(path, customers_df, n_orders, start='2024-01-01', end='2025-12-31',
+                     customer_skew=1.0, max_skus_per_order=5, n_skus=500, seed=0):
+    """
+    Writes 'n_orders' orders (one <order> element per SKU line, like the real export).
+    Returns the number of order items written.
+    """
+    rng = np.random.default_rng(seed)
+    start_ts = pd.Timestamp(start).value // 10 ** 9
+    end_ts = pd.Timestamp(end).value // 10 ** 9
+    mobiles = customers_df['mobile_number'].to_numpy()
+    # Shuffle which customers are the heavy buyers, so it isn't always the first rows
+    customer_order = rng.permutation(len(mobiles))
+
+    item_count = 0
+    with open(path, 'w') as f:
+        f.write('<orders>\n')
+        for block_start in range(0, n_orders, WRITE_BLOCK_SIZE):
+            block_size = min(WRITE_BLOCK_SIZE, n_orders - block_start)
+            order_numbers = np.arange(block_start + 1, block_start + block_size + 1)
+            buyers = mobiles[customer_order[_skewed_choice(rng, len(mobiles), block_size, customer_skew)]]
+            times = pd.to_datetime(rng.integers(start_ts, end_ts, size=block_size), unit='s')
+            times = times.strftime('%Y-%m-%dT%H:%M:%S')
+            amounts = rng.integers(100, 20000, size=block_size)
+            skus_per_order = rng.integers(1, max_skus_per_order + 1, size=block_size)
+
+            lines = []
+            for order_number, buyer, order_time, amount, sku_total in zip(
+                    order_numbers, buyers, times, amounts, skus_per_order):
+                # Distinct SKUs within one order, as order_items is keyed on (order_id, sku_id)
+                for sku in rng.choice(n_skus, size=sku_total, replace=False):
+                    lines.append(
+                        f"  <order>\n"
+                        f"    <order_id>ORD-{order_number:09d}</order_id>\n"
+                        f"    <mobile_number>{buyer}</mobile_number>\n"
+                        f"    <order_date_time>{order_time}</order_date_time>\n"
+                        f"    <sku_id>SKU-{1000 + sku}</sku_id>\n"
+                        f"    <sku_count>{rng.integers(1, 6)}</sku_count>\n"
+                        f"    <total_amount>{amount}</total_amount>\n"
+                        f"  </order>\n"
+                    )
+            item_count += len(lines)
+            f.write(''.join(lines))
+        f.write('</orders>\n')
+    return item_count
+
+
+def generate_dataset(out_dir, n_customers, n_orders, seed=0, **order_options):
+    """
+    Writes customers.csv and orders.xml into 'out_dir' and returns their paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    customer_file = os.path.join(out_dir, 'customers.csv')
+    order_file = os.path.join(out_dir, 'orders.xml')
+
+    customers_df = generate_customers(n_customers, seed=seed)
+    customers_df.to_csv(customer_file, index=False)
+    item_count = write_orders_xml(order_file, customers_df, n_orders, seed=seed, **order_options)
+    print(f"Wrote {n_customers} customers and {n_orders} orders ({item_count} items) to {out_dir}.")
+    return customer_file, order_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic customers/orders data.")
+    parser.add_argument('--out', default='data/synthetic', help="output directory")
+    parser.add_argument('--customers', type=int, default=10_000)
+    parser.add_argument('--orders', type=int, default=100_000)
+    parser.add_argument('--start', default='2024-01-01', help="first order date")
+    parser.add_argument('--end', default='2025-12-31', help="last order date")
+    parser.add_argument('--customer-skew', type=float, default=1.0,
+                        help="Zipf exponent for orders per customer (0 = uniform)")
+    parser.add_argument('--max-skus', type=int, default=5, help="max SKU lines per order")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_dataset(
+        args.out, args.customers, args.orders, seed=args.seed,
+        start=args.start, end=args.end,
+        customer_skew=args.customer_skew, max_skus_per_order=args.max_skus
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Import-time budget check for the CLI.
+
+Imports a module in a fresh interpreter with 'python -X importtime', reports the total
+and the slowest imports, and fails (exit code 1) if the total is over the budget or if
+a heavy library was imported eagerly.
+
+    python -m benchmarks.import_budget --module pipeline.cli --budget-ms 150
+"""
+import argparse
+import subprocess
+import sys
+
+# Libraries the CLI must only import once a stage actually needs them
+HEAVY_MODULES = ['pandas', 'numpy', 'sqlalchemy', 'mysql.connector', 'dotenv', 'pyarrow', 'duckdb', 'lxml']
+
+DEFAULT_BUDGET_MS = 150
+
+
+def measure_import(module):
+    """
+    Imports 'module' in a new process.
+    Returns (total ms, [(cumulative ms, name) of every import], heavy modules that got imported).
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, check=True
+    )
+
+    # Lines look like 'import time:   self [us] | cumulative [us] |   <indent>name'.
+    # The module and its parent packages are the top-level entries (one space of indent)
+    # that make up the total; interpreter start-up imports are left out.
+    packages = {module.rsplit('.', depth)[0] for depth in range(module.count('.') + 1)}
+    imports = []
+    total_ms = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        imports.append((int(cumulative) / 1000, name.strip()))
+        if not name.startswith('  ') and name.strip() in packages:
+            total_ms += int(cumulative) / 1000
+
+    heavy_loaded = [name for name in result.stdout.strip().split(',') if name]
+    return total_ms, imports, heavy_loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of a module against a budget.")
+    parser.add_argument('--module', default='pipeline.cli')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--top', type=int, default=10, help="how many of the slowest imports to show")
+    args = parser.parse_args()
+
+    total_ms, imports, heavy_loaded = measure_import(args.module)
+    print(f"Importing {args.module} took {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms).")
+    print("Slowest imports (cumulative):")
+    for ms, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    if heavy_loaded:
+        print(f"Error: heavy modules imported eagerly: {', '.join(heavy_loaded)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("Error: import time is over budget.")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
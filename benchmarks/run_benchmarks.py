@@ -0,0 +1,196 @@
+"""
+Scaling benchmark for both KPI paths.
+
+For every size it generates a synthetic dataset, then times each pipeline stage in a
+fresh process and records the peak RSS reached by the end of that stage:
+
+    extract      load_and_clean_data (cache disabled)
+    mem_pandas   in-memory KPIs, original merge + groupby path
+    mem_vector   in-memory KPIs, vectorized engine
+    mem_shard    in-memory KPIs, sharded over one process per core
+    sql_load     load_data_to_sql (bulk mode)            -- only with --db-url or --backend
+    sql_kpis     run_sql_kpi_queries                     -- only with --db-url or --backend
+
+The SQL stages run on a MySQL-compatible database (--db-url; point it at a local
+stand-in such as a throwaway MySQL container, never at production), or in process on
+an embedded backend (--backend duckdb/sqlite), where sql_load registers the frames
+(register_kpi_tables) instead of loading tables.
+
+    python -m benchmarks.run_benchmarks --sizes 10000 100000 1000000
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import queue as queue_module
+import resource
+import sys
+import tempfile
+import time
+import traceback
+
+from benchmarks.generate_data import generate_dataset
+
+# Customers per order in the generated data (so repeat customers are common)
+CUSTOMERS_PER_ORDER = 0.1
+
+# How often the parent checks that the benchmark process is still alive
+WORKER_POLL_SECONDS = 5
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _timed(results, stage, func):
+    """
+    Runs one stage with its printing silenced and records wall time and peak RSS so far.
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = func()
+    results[stage] = {
+        'seconds': round(time.perf_counter() - start, 4),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+    return value
+
+
+def _run_stages(customer_file, order_file, db_url, backend, queue):
+    """
+    Child-process body: runs the stages in order and sends the timings back, or
+    {'error': traceback} if a stage fails.
+    A fresh process per size keeps the RSS high-water mark from leaking between sizes.
+    """
+    try:
+        queue.put(_benchmark_stages(customer_file, order_file, db_url, backend))
+    except BaseException:
+        # Includes SystemExit: the pipeline exits on bad input
+        queue.put({'error': traceback.format_exc()})
+
+
+def _benchmark_stages(customer_file, order_file, db_url, backend):
+    # Synthetic ids must not end up in the real surrogate key store
+    os.environ['PIPELINE_KEY_STORE'] = os.path.join(os.path.dirname(order_file), 'surrogate_keys')
+    import sqlalchemy
+    from pipeline.data_processor import load_and_clean_data
+    from pipeline.pandas_analysis import run_in_memory_kpi_analysis
+    from pipeline.db_connector import create_embedded_backend
+    from pipeline.sql_analysis import load_data_to_sql, register_kpi_tables, run_sql_kpi_queries
+
+    results = {}
+    customers_df, unique_orders_df, order_items_df = _timed(
+        results, 'extract', lambda: load_and_clean_data(customer_file, order_file, use_cache=False)
+    )
+    # cache=None: the engines give the same results, so later ones would be served from the KPI cache
+    for stage, method in [('mem_pandas', 'pandas'), ('mem_vector', 'vectorized'), ('mem_shard', 'sharded')]:
+        _timed(results, stage, lambda: run_in_memory_kpi_analysis(
+            customers_df, unique_orders_df, method=method, cache=None
+        ))
+
+    if db_url:
+        engine = sqlalchemy.create_engine(db_url, pool_size=5, pool_pre_ping=True)
+        load_stats = _timed(results, 'sql_load', lambda: load_data_to_sql(
+            engine, customers_df, unique_orders_df, order_items_df, mode='bulk'
+        ))
+        # load_data_to_sql prints its error (silenced here) and returns no row counts;
+        # a failed load must not be reported as a timing
+        if not load_stats:
+            raise RuntimeError(f"load_data_to_sql returned no row counts, the load into {engine.url!r} failed.")
+        _timed(results, 'sql_kpis', lambda: run_sql_kpi_queries(engine))
+    elif backend:
+        engine = create_embedded_backend(backend, ':memory:')
+        _timed(results, 'sql_load', lambda: register_kpi_tables(engine, customers_df, unique_orders_df))
+        _timed(results, 'sql_kpis', lambda: run_sql_kpi_queries(engine))
+
+    results['rows'] = {
+        'customers': len(customers_df),
+        'orders': len(unique_orders_df),
+        'order_items': len(order_items_df),
+    }
+    return results
+
+
+def _wait_for_results(worker, queue):
+    """
+    Waits for the results of a benchmark process. Returns None if it died without
+    sending any (e.g. killed for running out of memory).
+    """
+    while True:
+        try:
+            return queue.get(timeout=WORKER_POLL_SECONDS)
+        except queue_module.Empty:
+            if worker.exitcode is not None:
+                # One last look, in case the results arrived just before it exited
+                try:
+                    return queue.get(timeout=1)
+                except queue_module.Empty:
+                    return None
+
+
+def benchmark_size(n_orders, work_dir, db_url=None, customer_skew=1.0, seed=0, backend=None):
+    """
+    Generates a dataset with 'n_orders' orders and benchmarks it in a child process.
+    """
+    data_dir = os.path.join(work_dir, f"orders_{n_orders}")
+    customer_file, order_file = generate_dataset(
+        data_dir, max(1, int(n_orders * CUSTOMERS_PER_ORDER)), n_orders,
+        seed=seed, customer_skew=customer_skew
+    )
+
+    queue = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=_run_stages, args=(customer_file, order_file, db_url, backend, queue))
+    worker.start()
+    results = _wait_for_results(worker, queue)
+    worker.join()
+    if results is None:
+        print(f"Error: the benchmark for {n_orders} orders exited with code {worker.exitcode} without results.")
+        sys.exit(1)
+    if 'error' in results:
+        print(f"Error: the benchmark for {n_orders} orders failed:\n{results['error']}")
+        sys.exit(1)
+    return results
+
+
+def print_report(report):
+    print(f"\n{'orders':>10} {'items':>10} {'stage':>11} {'seconds':>9} {'peak RSS MB':>12}")
+    for n_orders, results in report.items():
+        stages = [stage for stage in results if stage != 'rows']
+        for stage in stages:
+            print(f"{n_orders:>10} {results['rows']['order_items']:>10} {stage:>11} "
+                  f"{results[stage]['seconds']:>9.3f} {results[stage]['peak_rss_mb']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ETL stages at several data sizes.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help="number of orders per run")
+    sql_target = parser.add_mutually_exclusive_group()
+    sql_target.add_argument('--db-url', default=None,
+                            help="SQLAlchemy URL of a local MySQL-compatible database for the SQL stages")
+    sql_target.add_argument('--backend', default=None, choices=['duckdb', 'sqlite'],
+                            help="run the SQL stages on an embedded in-process backend instead")
+    parser.add_argument('--customer-skew', type=float, default=1.0)
+    parser.add_argument('--work-dir', default=None, help="where to write the generated data (default: temp dir)")
+    parser.add_argument('--output', default=None, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        report = {
+            n_orders: benchmark_size(n_orders, work_dir, args.db_url, args.customer_skew, backend=args.backend)
+            for n_orders in args.sizes
+        }
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,169 @@
 # --- 1. IMPORTS ---
-# Import functions from our new modules
-from pipeline.db_connector import create_db_engine
-from pipeline.data_processor import load_and_clean_data
-from pipeline.sql_analysis import load_data_to_sql, run_sql_kpi_queries
-from pipeline.pandas_analysis import run_in_memory_kpi_analysis
+# Heavy modules (pandas, SQLAlchemy, the MySQL driver) are only imported when they are
+# used, so 'import pipeline' and 'python -m pipeline --help' stay fast. The public
+# functions below are still available as attributes, e.g. pipeline.load_and_clean_data.
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    'create_db_engine': 'pipeline.db_connector',
+    'EmbeddedBackend': 'pipeline.db_connector',
+    'load_and_clean_data': 'pipeline.data_processor',
+    'load_data_to_sql': 'pipeline.sql_analysis',
+    'load_incremental_to_sql': 'pipeline.sql_analysis',
+    'get_watermark': 'pipeline.sql_analysis',
+    'run_sql_kpi_queries': 'pipeline.sql_analysis',
+    'stream_sql_kpi_queries': 'pipeline.sql_analysis',
+    'check_kpi_index_usage': 'pipeline.sql_analysis',
+    'register_kpi_tables': 'pipeline.sql_analysis',
+    'run_in_memory_kpi_analysis': 'pipeline.pandas_analysis',
+    'make_sink': 'pipeline.sinks',
+    'run_stage_graph': 'pipeline.scheduler',
+    'write_metrics_report': 'pipeline.metrics',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module 'pipeline' has no attribute '{name}'")
+
 
 # --- 2. CONSTANTS ---
 # Define file paths in one central place
+# (ORDER_FILE_PATH may also be a directory or a glob like 'data/orders/*.xml' for sharded exports)
 CUSTOMER_FILE_PATH = 'data/task_DE_new_customers.csv'
 ORDER_FILE_PATH = 'data/task_DE_new_orders.xml'
 
+# 'bulk' = batched inserts into staging tables + atomic swap, 'replace' = plain to_sql,
+# 'incremental' = only orders past the stored watermark are transformed and appended
+# (With DB_BACKEND=duckdb/sqlite in .env there is no server: the frames are registered
+# with the embedded engine instead of loaded, and LOAD_MODE is ignored.)
+LOAD_MODE = 'bulk'
+
+# The stages a full run ends with
+ALL_TARGETS = ('load', 'sql_kpis', 'mem_kpis')
+
+# Where KPI results are written: 'stdout', 'csv:<dir>', 'jsonl:<dir>', 'parquet:<dir>'
+# or 'sql[:<url>]' (see pipeline.sinks)
+SINK_SPEC = 'stdout'
+
+
 # --- 3. MAIN EXECUTION ---
-def main():
+def run_pipeline(targets=ALL_TARGETS, customer_file=CUSTOMER_FILE_PATH, order_file=ORDER_FILE_PATH,
+                 load_mode=LOAD_MODE, backend=None, sink_spec=SINK_SPEC, mem_kpi_method='vectorized'):
     """
-    Main function to run the entire ETL and analysis pipeline.
-    This function now just orchestrates the steps.
+    Runs the given target stages plus everything they depend on.
+    The steps run as a dependency graph, so independent branches run at the same time:
+
+        connect ──┐
+                  ├─> load ──> sql_kpis
+        extract ──┤
+                  └─> mem_kpis
+
+    The database is only connected to if a selected stage needs it. 'sql_kpis' without
+    'load' queries what is already in MySQL (an embedded backend always needs the load).
+    'backend' overrides DB_BACKEND from the environment.
+    'sink_spec' says where the KPI results go; with anything but stdout the SQL KPIs are
+    streamed from the database in batches instead of being fetched whole.
+    'mem_kpi_method' picks the in-memory KPI engine (see run_in_memory_kpi_analysis).
     """
-    print("===== Akasha Air Data Engineering ETL Pipeline =====")
-    
+    from pipeline.db_connector import EmbeddedBackend, create_db_engine, get_db_backend
+    from pipeline.metrics import write_metrics_report
+    from pipeline.scheduler import run_stage_graph
+    from pipeline.sinks import make_sink
+
+    embedded = get_db_backend(backend) != 'mysql'
+    incremental = load_mode == 'incremental' and not embedded
+
     # --- Step 1: Connect to Database ---
-    # (We connect first to fail fast if DB is down)
-    db_engine = create_db_engine()
+    # (Runs alongside extraction; we still fail fast if the DB is down)
+    def connect():
+        return create_db_engine(backend=backend)
 
     # --- Step 2: Extract, Transform (from your notebook logic) ---
-    customers_df, unique_orders_df, order_items_df = load_and_clean_data(
-        CUSTOMER_FILE_PATH, 
-        ORDER_FILE_PATH
-    )
+    # In incremental mode we only want the orders we haven't loaded yet,
+    # so extraction has to wait for the connection to read the watermark.
+    def extract(db_engine=None):
+        from pipeline.data_processor import load_and_clean_data
+        from pipeline.sql_analysis import get_watermark
+
+        watermark = get_watermark(db_engine) if db_engine is not None else None
+        customers_df, unique_orders_df, order_items_df = load_and_clean_data(
+            customer_file,
+            order_file,
+            since=watermark
+        )
+        return customers_df, unique_orders_df, order_items_df, watermark
 
     # --- Step 3: Run Requirement A (Table-Based) ---
-    load_data_to_sql(db_engine, customers_df, unique_orders_df, order_items_df)
-    run_sql_kpi_queries(db_engine)
+    def load(db_engine, extracted):
+        from pipeline.sql_analysis import load_data_to_sql, load_incremental_to_sql, register_kpi_tables
+
+        customers_df, unique_orders_df, order_items_df, _ = extracted
+        if isinstance(db_engine, EmbeddedBackend):
+            register_kpi_tables(db_engine, customers_df, unique_orders_df)
+        elif incremental:
+            load_incremental_to_sql(db_engine, customers_df, unique_orders_df, order_items_df)
+        else:
+            load_data_to_sql(db_engine, customers_df, unique_orders_df, order_items_df, mode=load_mode)
+
+    def sql_kpis(db_engine, *_):
+        from pipeline.sql_analysis import check_kpi_index_usage, run_sql_kpi_queries, stream_sql_kpi_queries
+
+        with make_sink(sink_spec, prefix='sql_') as sink:
+            if sink_spec == 'stdout':
+                run_sql_kpi_queries(db_engine, sink=sink)
+            else:
+                stream_sql_kpi_queries(db_engine, sink)
+        if not isinstance(db_engine, EmbeddedBackend):
+            check_kpi_index_usage(db_engine)
 
     # --- Step 4: Run Requirement B (In-Memory) ---
-    run_in_memory_kpi_analysis(customers_df, unique_orders_df)
-    
+    # The in-memory KPIs need the full history, which an incremental run doesn't extract
+    def mem_kpis(extracted):
+        from pipeline.pandas_analysis import run_in_memory_kpi_analysis
+
+        customers_df, unique_orders_df, _, watermark = extracted
+        if watermark is None:
+            with make_sink(sink_spec, prefix='mem_') as sink:
+                run_in_memory_kpi_analysis(customers_df, unique_orders_df, method=mem_kpi_method, sink=sink)
+        else:
+            print("\nSkipping in-memory KPIs: this incremental run only extracted new orders.")
+
+    stages = {
+        'connect': (connect, []),
+        'extract': (extract, ['connect'] if incremental and 'load' in targets else []),
+        'load': (load, ['connect', 'extract']),
+        'sql_kpis': (sql_kpis, ['connect', 'load'] if embedded or 'load' in targets else ['connect']),
+        'mem_kpis': (mem_kpis, ['extract']),
+    }
+
+    # Keep only the targets and what they (transitively) depend on
+    selected = set()
+    to_visit = list(targets)
+    while to_visit:
+        name = to_visit.pop()
+        if name not in selected:
+            selected.add(name)
+            to_visit.extend(stages[name][1])
+
+    # Per-stage metrics are written even if a stage fails
+    try:
+        run_stage_graph({name: stage for name, stage in stages.items() if name in selected})
+    finally:
+        write_metrics_report()
+
+
+def main():
+    """
+    Main function to run the entire ETL and analysis pipeline.
+    This function now just orchestrates the steps (see run_pipeline).
+    """
+    print("===== Akasha Air Data Engineering ETL Pipeline =====")
+    run_pipeline()
     print("\n Extarct-transform-load--pipeline execution complete.")
 
 
 # This standard Python entry point makes the script runnable
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import shutil
+import time
+
+# --- CONSTANTS ---
+# Where the cleaned DataFrames are kept between runs
+CACHE_DIR = '.cache/parsed'
+
+# Oldest (least recently used) entries are removed once the cache grows past this size
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Bump this whenever the transform logic changes, so old cache entries are never reused
+PIPELINE_VERSION = '7'
+
+# Files are hashed in blocks, so even multi-GB inputs never have to fit in memory
+HASH_BLOCK_SIZE = 1024 * 1024
+
+CACHED_FRAMES = ['customers_df', 'unique_orders_df', 'order_items_df']
+
+# Month-partitioned Parquet copy of unique_orders_df in every entry (see pipeline.order_partitions)
+ORDERS_DATASET_NAME = 'orders_by_month'
+
+
+def _pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def compute_cache_key(*file_paths, salt=''):
+    """
+    Builds the cache key from the *content* of the input files plus the pipeline version
+    (and 'salt', for other state the cached result depends on).
+    Renaming or touching a file keeps the key; changing a single byte gives a new one.
+    """
+    digest = hashlib.sha256(f"pipeline-v{PIPELINE_VERSION}-{salt}".encode())
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        # Separate the files so 'ab' + 'c' and 'a' + 'bc' don't collide
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _table_to_frame(table):
+    """
+    Converts a memory-mapped Arrow table to a DataFrame without copying what doesn't need it.
+    Numeric and timestamp columns without nulls become read-only NumPy views of the mapped
+    file, and categoricals keep their codes that way; pages are only read in when touched.
+    Strings, columns with nulls and multi-chunk columns (entries from older versions) are
+    copied into pandas as usual.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        try:
+            if column.num_chunks != 1:
+                raise pa.ArrowInvalid("multi-chunk column")
+            array = column.chunk(0)
+            if pa.types.is_dictionary(array.type):
+                columns[name] = pd.Categorical.from_codes(
+                    array.indices.to_numpy(zero_copy_only=True), array.dictionary.to_pandas()
+                )
+            else:
+                columns[name] = array.to_numpy(zero_copy_only=True)
+        except (pa.ArrowInvalid, NotImplementedError):
+            columns[name] = column.to_pandas()
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_cached_frames(cache_key, cache_dir=CACHE_DIR):
+    """
+    Returns the cached (customers_df, unique_orders_df, order_items_df), or None on a miss.
+    Frames are stored as uncompressed Arrow (Feather) files and read memory-mapped, with no
+    parsing. The numeric columns stay views of the mapped files (see _table_to_frame), so a
+    cache hit only becomes resident as the columns are read; string columns are copied.
+    """
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if not _pyarrow_available() or not os.path.isdir(entry_dir):
+        return None
+
+    from pyarrow import feather
+
+    frames = tuple(
+        _table_to_frame(feather.read_table(os.path.join(entry_dir, f"{name}.arrow"), memory_map=True))
+        for name in CACHED_FRAMES
+    )
+    # Touch the entry so eviction treats it as recently used
+    os.utime(entry_dir)
+    return frames
+
+
+def cached_frame_paths(cache_key, cache_dir=CACHE_DIR):
+    """
+    Returns {frame name: Arrow file path} of a cache entry, plus ORDERS_DATASET_NAME: the
+    month-partitioned orders directory, or None if there is no such entry.
+    Lets other readers (e.g. an embedded SQL engine) scan the cached files without loading them.
+    """
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if not os.path.isdir(entry_dir):
+        return None
+    paths = {name: os.path.join(entry_dir, f"{name}.arrow") for name in CACHED_FRAMES}
+    paths[ORDERS_DATASET_NAME] = os.path.join(entry_dir, ORDERS_DATASET_NAME)
+    return paths
+
+
+def save_cached_frames(cache_key, frames, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    Stores the cleaned frames under 'cache_key', then evicts old entries above 'max_bytes'.
+    The orders are also stored partitioned by month, for readers that only need some months.
+    The entry is written to a temporary folder and renamed, so readers never see half of it.
+    """
+    if not _pyarrow_available():
+        print("Note: 'pyarrow' is not installed, so parsed data is not cached.")
+        return
+
+    entry_dir = os.path.join(cache_dir, cache_key)
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        for name, df in zip(CACHED_FRAMES, frames):
+            # One record batch per file, so every column can be mapped as a single array
+            df.reset_index(drop=True).to_feather(
+                os.path.join(tmp_dir, f"{name}.arrow"), compression='uncompressed', chunksize=max(len(df), 1)
+            )
+        from pipeline.order_partitions import write_orders_dataset
+        write_orders_dataset(frames[1], os.path.join(tmp_dir, ORDERS_DATASET_NAME))
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.replace(tmp_dir, entry_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict_cache(cache_dir, max_bytes)
+
+
+def _dir_size(path):
+    return sum(
+        entry.stat().st_size if entry.is_file() else _dir_size(entry.path)
+        for entry in os.scandir(path)
+    )
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    Removes the least recently used cache entries until the cache fits in 'max_bytes'.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = sorted(
+        (entry.stat().st_mtime, entry.path, _dir_size(entry.path))
+        for entry in os.scandir(cache_dir)
+        if entry.is_dir() and '.tmp-' not in entry.name
+    )
+    total_bytes = sum(size for _, _, size in entries)
+
+    # Always keep the newest entry, even if it alone is over the limit
+    for last_used, path, size in entries[:-1]:
+        if total_bytes <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+        print(f"Evicted cache entry {os.path.basename(path)[:12]} (last used {time.ctime(last_used)}).")
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """
+    Deletes every cache entry.
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
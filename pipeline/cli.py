@@ -0,0 +1,91 @@
+"""
+Command-line entry point:
+
+    python -m pipeline extract      parse and clean the input files (fills the parse cache)
+    python -m pipeline load         extract + load into the database
+    python -m pipeline sql-kpis     run the SQL KPIs on what is already loaded
+    python -m pipeline mem-kpis     extract + in-memory KPIs, no database needed
+                        --chunked   stream the orders into partial aggregates instead
+                                    (for histories that don't fit in memory)
+                        --method partitioned
+                                    reduce the month partitions of the orders in parallel
+                        --method sharded
+                                    split the orders by customer over all CPU cores
+    python -m pipeline all          everything (same as running pipeline.main)
+
+Every command takes --sink to send the KPI results somewhere other than the terminal,
+e.g. --sink parquet:out/kpis or --sink sql (see pipeline.sinks).
+
+Only this module and the (light) package are imported up front; pandas, SQLAlchemy and
+the database driver are imported by the stages that need them, and the database is only
+connected to by 'load', 'sql-kpis' and 'all'.
+"""
+import argparse
+import sys
+
+import pipeline
+
+# Subcommand -> target stages of the pipeline graph
+COMMAND_TARGETS = {
+    'extract': ('extract',),
+    'load': ('load',),
+    'sql-kpis': ('sql_kpis',),
+    'mem-kpis': ('mem_kpis',),
+    'all': pipeline.ALL_TARGETS,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m pipeline', description="Akasha Air ETL pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, targets in COMMAND_TARGETS.items():
+        subparser = subparsers.add_parser(command, help=f"run stages: {', '.join(targets)}")
+        subparser.add_argument('--customers', default=pipeline.CUSTOMER_FILE_PATH, help="customer CSV file")
+        subparser.add_argument('--orders', default=pipeline.ORDER_FILE_PATH,
+                               help="order XML file, directory or glob")
+        subparser.add_argument('--load-mode', default=pipeline.LOAD_MODE,
+                               choices=['replace', 'bulk', 'incremental'])
+        subparser.add_argument('--backend', default=None, choices=['mysql', 'duckdb', 'sqlite'],
+                               help="SQL backend (default: DB_BACKEND from the environment, else mysql)")
+        subparser.add_argument('--sink', default=pipeline.SINK_SPEC,
+                               help="where KPI results go: stdout, csv:<dir>, jsonl:<dir>, parquet:<dir>, sql[:<url>]")
+        if command == 'mem-kpis':
+            subparser.add_argument('--chunked', action='store_true',
+                                   help="aggregate the orders chunk by chunk without loading them all")
+            subparser.add_argument('--method', default='vectorized',
+                                   choices=['vectorized', 'pandas', 'partitioned', 'sharded'],
+                                   help="in-memory KPI engine")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print("===== Akasha Air Data Engineering ETL Pipeline =====")
+    if getattr(args, 'chunked', False):
+        from pipeline.kpi_partial import run_chunked_kpi_analysis
+        from pipeline.metrics import write_metrics_report
+        from pipeline.sinks import make_sink
+
+        try:
+            with make_sink(args.sink, prefix='mem_') as sink:
+                run_chunked_kpi_analysis(args.customers, args.orders, sink=sink)
+        finally:
+            write_metrics_report()
+        print(f"\n'{args.command}' finished.")
+        return 0
+
+    pipeline.run_pipeline(
+        COMMAND_TARGETS[args.command],
+        customer_file=args.customers,
+        order_file=args.orders,
+        load_mode=args.load_mode,
+        backend=args.backend,
+        sink_spec=args.sink,
+        mem_kpi_method=getattr(args, 'method', 'vectorized'),
+    )
+    print(f"\n'{args.command}' finished.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
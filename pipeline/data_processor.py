@@ -1,49 +1,378 @@
+import glob
+import os
+import uuid
 import pandas as pd
 import sys
+from pandas.api.types import union_categoricals
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from pipeline.cache import (
+    ORDERS_DATASET_NAME, cached_frame_paths, compute_cache_key, load_cached_frames, save_cached_frames
+)
+from pipeline.data_quality import parse_customer_fields, parse_order_fields, quarantine_orders, write_quarantine
+from pipeline.metrics import track_stage
+from pipeline.surrogate_keys import assign_surrogate_keys, key_store_id
 
-def load_and_clean_data(customer_file, order_file):
+# --- CONSTANTS ---
+# How many <order> elements we collect before turning them into a DataFrame.
+# Peak memory while parsing depends on this number, not on the XML file size.
+ORDER_CHUNK_SIZE = 50_000
+
+# The fields inside every <order> element, in the order we read them
+ORDER_FIELDS = ['order_id', 'mobile_number', 'order_date_time', 'sku_id', 'sku_count', 'total_amount']
+ORDER_HEADER_COLUMNS = ['order_id', 'mobile_number', 'order_date_time', 'total_amount']
+ORDER_ITEM_COLUMNS = ['order_id', 'sku_id', 'sku_count']
+
+# --- COMPACT SCHEMA ---
+# Explicit dtypes applied at read time instead of letting pandas infer object/int64 columns.
+# Repeated strings become categoricals (small integer codes + one copy of each value),
+# counts get the smallest integer type that fits, and amounts are rounded to paise.
+CUSTOMER_DTYPES = {
+    'mobile_number': 'int64',
+    'region': 'category',
+}
+# Mobile numbers are read as text first, so a missing or malformed one can be quarantined
+CUSTOMER_READ_DTYPES = {**CUSTOMER_DTYPES, 'mobile_number': 'str'}
+ORDER_DTYPES = {
+    'order_id': 'category',
+    'mobile_number': 'int64',
+    'sku_id': 'category',
+    'sku_count': 'int16',
+    'total_amount': 'float64',
+}
+AMOUNT_DECIMALS = 2
+
+# Processes used to parse several order files at once (None = one per CPU core)
+ORDER_PARSE_WORKERS = None
+
+
+def _build_order_chunk(records):
+    """
+    Turns a list of raw <order> field tuples into a DataFrame with the compact schema.
+    Rows with values that don't parse are left out (see data_quality.parse_order_fields).
+    Returns (typed chunk, rejected raw rows with a 'reason' column).
+    """
+    raw_df = pd.DataFrame.from_records(records, columns=ORDER_FIELDS)
+    parsed, reason = parse_order_fields(raw_df)
+    chunk = raw_df.assign(**parsed)
+    chunk['total_amount'] = chunk['total_amount'].round(AMOUNT_DECIMALS)
+
+    is_bad = reason != None  # noqa: E711 (element-wise on an object array)
+    if not is_bad.any():
+        return chunk.astype(ORDER_DTYPES), raw_df.iloc[:0].assign(reason=[])
+    return chunk[~is_bad].astype(ORDER_DTYPES), raw_df[is_bad].assign(reason=reason[is_bad])
+
+
+def read_customers(customer_file):
+    """
+    Reads the customer CSV with the compact schema. Rows without a valid mobile number,
+    or with one an earlier row already has, are left out (see data_quality.parse_customer_fields).
+    Returns (customers_df, rejected raw rows with a 'reason' column).
+    """
+    raw_df = pd.read_csv(customer_file, dtype=CUSTOMER_READ_DTYPES)
+    mobile_numbers, reason = parse_customer_fields(raw_df)
+    is_bad = reason != None  # noqa: E711 (element-wise on an object array)
+    customers_df = raw_df[~is_bad].assign(mobile_number=mobile_numbers[~is_bad]).astype(CUSTOMER_DTYPES)
+    return customers_df.reset_index(drop=True), raw_df[is_bad].assign(reason=reason[is_bad])
+
+
+def concat_chunks(chunks):
+    """
+    Concatenates typed chunks without losing their categorical columns.
+    pd.concat falls back to 'object' when chunks have different categories, so each
+    categorical column is combined with union_categoricals instead: one pass that builds
+    the union of the categories and re-codes every chunk onto it.
+    """
+    chunks = list(chunks)
+    categorical = [column for column in chunks[0].columns
+                   if isinstance(chunks[0][column].dtype, pd.CategoricalDtype)]
+    combined_df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        combined_df[column] = union_categoricals([chunk[column] for chunk in chunks])
+    return combined_df[chunks[0].columns]
+
+
+def drop_unused_categories(df):
+    """
+    Drops the categories no row uses any more (e.g. after filtering), so a small
+    frame doesn't carry every order_id of the file it was cut from.
+    """
+    return df.assign(**{
+        column: df[column].cat.remove_unused_categories()
+        for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)
+    })
+
+
+def report_memory_usage(frames):
+    """
+    Prints how much memory each DataFrame in {name: df} takes (including the strings it points to).
+    """
+    print("Memory usage:")
+    for name, df in frames.items():
+        print(f"  {name}: {len(df)} rows, {df.memory_usage(deep=True).sum() / 1024 ** 2:.2f} MB")
+
+
+def iter_order_chunks(order_file, chunk_size=ORDER_CHUNK_SIZE, rejected=None):
+    """
+    Streams the order XML with lxml's iterparse instead of building the whole tree.
+    Every <order> element is cleared (and dropped from its parent) as soon as it is read.
+    Yields typed DataFrames of at most 'chunk_size' order *items*. Items with unparseable
+    values are skipped; pass a list as 'rejected' to collect them (raw, with a reason).
+    """
+    def build(records):
+        chunk, rejected_rows = _build_order_chunk(records)
+        if rejected is not None and len(rejected_rows):
+            rejected.append(rejected_rows.assign(source_file=order_file))
+        return chunk
+
+    records = []
+    for _, elem in etree.iterparse(order_file, events=('end',), tag='order'):
+        records.append(tuple(elem.findtext(field) for field in ORDER_FIELDS))
+
+        # Free the element and everything parsed before it (including comments)
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+        if len(records) >= chunk_size:
+            yield build(records)
+            records = []
+
+    if records:
+        yield build(records)
+
+
+def filter_after_watermark(chunk, since):
+    """
+    Keeps only the order items that come after the high-water mark.
+    'since' is an (order_date_time, order_id) tuple; ties on the timestamp are broken by order_id.
+    """
+    since_time, since_order_id = since
+    is_newer = (chunk['order_date_time'] > since_time) | (
+        (chunk['order_date_time'] == since_time) & (chunk['order_id'].astype(str) > since_order_id)
+    )
+    return drop_unused_categories(chunk[is_newer])
+
+
+def _tag_data_version(frames, data_version):
+    """
+    Stamps the frames with the version of the data they hold (the input content hash
+    when we have it). KPI results cached for these frames are keyed on this version.
+    """
+    for df in frames:
+        df.attrs['data_version'] = data_version
+
+
+def _tag_orders_dataset(unique_orders_df, cache_key):
+    """
+    Records where the month-partitioned copy of the orders lives (see pipeline.order_partitions).
+    """
+    paths = cached_frame_paths(cache_key)
+    if paths is not None:
+        unique_orders_df.attrs['orders_dataset'] = paths[ORDERS_DATASET_NAME]
+
+
+def add_surrogate_keys(customers_df, unique_orders_df, order_items_df):
+    """
+    Turns the cleaned frames into a star schema joined on dense integer keys:
+
+        customers_df      customer_key, customer_id, customer_name, mobile_number, region
+        unique_orders_df  order_key, order_id, customer_key, order_date_time, total_amount
+        order_items_df    order_key, sku_key, sku_count
+
+    (the SKU dimension lives in the key store, see surrogate_keys.get_sku_dim).
+    Keys are stable across runs. (Orders of unknown mobile numbers were quarantined before
+    this, see data_quality; if one slips through it still gets a customer_key, it just has
+    no row in customers_df.)
+    """
+    customers_df.insert(0, 'customer_key', assign_surrogate_keys('customer', customers_df['mobile_number']))
+
+    order_keys = assign_surrogate_keys('order', unique_orders_df['order_id'])
+    # Every item's order has its header row here, so the items reuse those keys rather than
+    # looking the same order ids up in the key store again
+    item_order_pos = pd.Index(unique_orders_df['order_id'].to_numpy()).get_indexer(
+        order_items_df['order_id'].to_numpy()
+    )
+    if (item_order_pos < 0).any():
+        item_order_keys = assign_surrogate_keys('order', order_items_df['order_id'])
+    else:
+        item_order_keys = order_keys[item_order_pos]
+
+    unique_orders_df = pd.DataFrame({
+        'order_key': order_keys,
+        'order_id': unique_orders_df['order_id'].reset_index(drop=True),
+        'customer_key': assign_surrogate_keys('customer', unique_orders_df['mobile_number']),
+        'order_date_time': unique_orders_df['order_date_time'].to_numpy(),
+        'total_amount': unique_orders_df['total_amount'].to_numpy(),
+    })
+    order_items_df = pd.DataFrame({
+        'order_key': item_order_keys,
+        'sku_key': assign_surrogate_keys('sku', order_items_df['sku_id']),
+        'sku_count': order_items_df['sku_count'].to_numpy(),
+    })
+    return customers_df, unique_orders_df, order_items_df
+
+
+def resolve_order_files(order_source):
+    """
+    Turns the order input into a sorted list of XML files.
+    'order_source' can be a single file, a directory (every *.xml inside) or a glob pattern.
+    """
+    if os.path.isdir(order_source):
+        order_files = glob.glob(os.path.join(order_source, '*.xml'))
+    elif glob.has_magic(order_source):
+        order_files = glob.glob(order_source)
+    else:
+        order_files = [order_source]
+    return sorted(order_files)
+
+
+def _extract_order_file(order_file, chunk_size, since):
+    """
+    Parses one order XML file chunk by chunk.
+    Returns (unique orders, order items, number of items read, rejected items) for that file.
+    Runs inside a worker process when several files are parsed at once.
+    """
+    unique_order_chunks = []
+    order_item_chunks = []
+    rejected = []
+    item_count = 0
+    for chunk in iter_order_chunks(order_file, chunk_size, rejected):
+        item_count += len(chunk)
+        if since is not None:
+            chunk = filter_after_watermark(chunk, since)
+        # Each chunk is de-duplicated on its own, so only its unique orders are kept
+        unique_order_chunks.append(chunk[ORDER_HEADER_COLUMNS].drop_duplicates())
+        order_item_chunks.append(chunk[ORDER_ITEM_COLUMNS])
+
+    item_count += sum(len(rows) for rows in rejected)
+    if not unique_order_chunks:
+        return None, None, item_count, rejected
+    return concat_chunks(unique_order_chunks), concat_chunks(order_item_chunks), item_count, rejected
+
+
+def load_and_clean_data(customer_file, order_file, chunk_size=ORDER_CHUNK_SIZE, since=None,
+                        use_cache=True, refresh_cache=False, max_workers=ORDER_PARSE_WORKERS):
     """
     Loads data from CSV and XML (Extract).
     Cleans, transforms, and normalizes it (Transform).
+    The XML is read in chunks of 'chunk_size' items, so it never has to fit in memory at once.
+    If 'since' (a watermark tuple) is given, only orders after it are transformed and returned.
+
+    'order_file' can also be a directory or a glob pattern of XML shards. Several shards
+    are parsed in parallel in a process pool ('max_workers' processes).
+
+    Full extractions are cached on disk, keyed by the input files' content. If the files
+    haven't changed, the cleaned frames are read back from the cache without parsing.
+    'refresh_cache=True' ignores the cached copy and parses the files again.
     """
     print("\n--- Starting Data Extraction & Transformation ---")
-    
+
+    order_files = resolve_order_files(order_file)
+    if not order_files:
+        print(f"Error: No order files found at {order_file}")
+        sys.exit(1)
+
+    cache_key = None
+    if use_cache and since is None:
+        try:
+            cache_key = compute_cache_key(customer_file, *order_files, salt=key_store_id())
+        except FileNotFoundError as e:
+            print(f"Error: Input file not found at {e.filename}")
+            sys.exit(1)
+
+        with track_stage('extract.cache_lookup') as record:
+            cached_frames = None if refresh_cache else load_cached_frames(cache_key)
+            record['rows_out'] = len(cached_frames[1]) if cached_frames is not None else 0
+        if cached_frames is not None:
+            print(f"Loaded cleaned data from cache (key {cache_key[:12]}), skipping the parse.")
+            report_memory_usage(dict(zip(['customers_df', 'unique_orders_df', 'order_items_df'], cached_frames)))
+            _tag_data_version(cached_frames, cache_key)
+            _tag_orders_dataset(cached_frames[1], cache_key)
+            return cached_frames
+
     try:
-        customers_df = pd.read_csv(customer_file)
+        with track_stage('extract.customers') as record:
+            customers_df, rejected_customers_df = read_customers(customer_file)
+            record['rows_out'] = len(customers_df)
         print(f"Loaded {len(customers_df)} customer records from CSV.")
+        write_quarantine([rejected_customers_df], kind='customers')
     except FileNotFoundError:
         print(f"Error: Customer file not found at {customer_file}")
         sys.exit(1)
 
+    # --- Data Transformation & Cleaning (chunk by chunk, file by file) ---
     try:
-        all_orders_df = pd.read_xml(order_file, xpath='//order')
-        print(f"Loaded {len(all_orders_df)} order *items* from XML.")
-    except FileNotFoundError:
-        print(f"Error: Order file not found at {order_file}")
+        with track_stage('extract.orders') as orders_record:
+            if len(order_files) == 1:
+                file_results = [_extract_order_file(order_files[0], chunk_size, since)]
+            else:
+                print(f"Parsing {len(order_files)} order files in parallel...")
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    file_results = list(pool.map(
+                        _extract_order_file,
+                        order_files,
+                        [chunk_size] * len(order_files),
+                        [since] * len(order_files)
+                    ))
+            orders_record['rows_in'] = sum(result[2] for result in file_results)
+    except FileNotFoundError as e:
+        print(f"Error: Order file not found at {e.filename}")
         sys.exit(1)
     except Exception as e:
-        print(f"Error reading XML (is 'lxml' installed?): {e}")
+        print(f"Error reading XML: {e}")
+        sys.exit(1)
+
+    item_count = sum(result[2] for result in file_results)
+    print(f"Loaded {item_count} order *items* from XML.")
+    if item_count == 0:
+        print("Error: No <order> elements found in the XML file.")
+        sys.exit(1)
+
+    # Items with unparseable values were already left out while parsing
+    rejected = [rows for result in file_results for rows in result[3]]
+    file_results = [result for result in file_results if result[0] is not None]
+    if not file_results:
+        write_quarantine(rejected)
+        print("Error: No valid <order> elements found in the XML file.")
         sys.exit(1)
 
-    # --- Data Transformation & Cleaning ---
-    
-    unique_orders_df = all_orders_df[[
-        'order_id', 
-        'mobile_number', 
-        'order_date_time', 
-        'total_amount'
-    ]].drop_duplicates().copy()
-
-    order_items_df = all_orders_df[[
-        'order_id', 
-        'sku_id', 
-        'sku_count'
-    ]]
-
-    unique_orders_df['order_date_time'] = pd.to_datetime(unique_orders_df['order_date_time'])
-    unique_orders_df['total_amount'] = pd.to_numeric(unique_orders_df['total_amount'])
-    
+    # An order's items can be split across chunks (or shards), so we de-duplicate once more
+    with track_stage('extract.combine', rows_in=item_count) as record:
+        unique_orders_df = concat_chunks(result[0] for result in file_results).drop_duplicates()
+        order_items_df = concat_chunks(result[1] for result in file_results)
+        record['rows_out'] = len(unique_orders_df)
+
+    # --- Data quality: orders with conflicting headers or unknown customers ---
+    # Must run before the orders are keyed: one order_id may only have one header row
+    with track_stage('extract.validate', rows_in=len(unique_orders_df)) as record:
+        unique_orders_df, order_items_df, rejected_orders = quarantine_orders(
+            unique_orders_df, order_items_df, customers_df
+        )
+        unique_orders_df = drop_unused_categories(unique_orders_df)
+        order_items_df = drop_unused_categories(order_items_df)
+        record['rows_out'] = len(unique_orders_df)
+    write_quarantine([*rejected, *rejected_orders])
+
+    # Integer surrogate keys replace the string/phone-number join keys
+    with track_stage('extract.surrogate_keys', rows_in=len(unique_orders_df) + len(order_items_df)):
+        customers_df, unique_orders_df, order_items_df = add_surrogate_keys(
+            customers_df, unique_orders_df, order_items_df
+        )
+
+    if since is not None:
+        print(f"Kept only orders after watermark {since[0]} / {since[1]}.")
     print(f"Processed {len(unique_orders_df)} unique orders.")
+    report_memory_usage({
+        'customers_df': customers_df,
+        'unique_orders_df': unique_orders_df,
+        'order_items_df': order_items_df,
+    })
     print("Data cleaning and preprocessing complete.")
-    
-    return customers_df, unique_orders_df, order_items_df
\ No newline at end of file
+
+    if cache_key is not None:
+        save_cached_frames(cache_key, (customers_df, unique_orders_df, order_items_df))
+        _tag_orders_dataset(unique_orders_df, cache_key)
+
+    _tag_data_version((customers_df, unique_orders_df, order_items_df), cache_key or uuid.uuid4().hex)
+    return customers_df, unique_orders_df, order_items_df
@@ -0,0 +1,155 @@
+"""
+Data-quality checks on the parsed orders and customers. Rows that fail a check are taken
+out of the pipeline and written to a quarantine CSV with a reason code:
+
+    missing_<field>           one of the six order fields (order_id, mobile_number,
+                              order_date_time, sku_id, sku_count, total_amount) is
+                              absent or blank
+    bad_mobile_number         not an integer (or too large for int64)
+    bad_sku_count             not an integer, or outside the int16 range of its column
+    bad_order_date_time       not a date
+    bad_total_amount          not a number
+    non_positive_sku_count    sku_count <= 0
+    orphan_mobile_number      the mobile number is not in the customer file
+    conflicting_order_header  the items of one order_id disagree on mobile number,
+                              order time or total amount (would count the order twice)
+    duplicate_order_item      a second line of the same sku_id in one order
+
+Customers are only checked for their mobile number, the key their orders are matched
+on: missing_mobile_number, bad_mobile_number, or duplicate_mobile_number (a number
+already used by an earlier row of the file).
+
+The row checks run on every parsed chunk, the order checks once on the combined order
+headers. Each check is one vectorized pass (a comparison, isin or duplicated), so the
+cost grows linearly with the rows and stays small next to the XML parse.
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# --- CONSTANTS ---
+# Where rejected rows go, one CSV per run that rejected anything (env PIPELINE_QUARANTINE_DIR)
+QUARANTINE_DIR = os.getenv("PIPELINE_QUARANTINE_DIR", 'quarantine')
+
+# Every order field is required: the ids are join keys, and the loaders' columns are NOT NULL
+REQUIRED_ORDER_FIELDS = ['order_id', 'mobile_number', 'order_date_time', 'sku_id', 'sku_count', 'total_amount']
+# Integer columns and the dtype they are stored in (data_processor.ORDER_DTYPES); a value
+# outside the dtype's range would wrap around silently in the cast
+INTEGER_COLUMNS = {'mobile_number': 'int64', 'sku_count': 'int16'}
+VALUE_COLUMNS = ['order_date_time', 'total_amount']
+
+
+def parse_order_fields(raw_df):
+    """
+    Parses the raw (string) order fields without raising on bad values.
+    Returns (parsed columns, reason per row or None). Unparseable values become NaN/NaT
+    in the parsed columns; the first failed check of a row is its reason.
+    """
+    parsed = {
+        'mobile_number': pd.to_numeric(raw_df['mobile_number'], errors='coerce'),
+        'sku_count': pd.to_numeric(raw_df['sku_count'], errors='coerce'),
+        'order_date_time': pd.to_datetime(raw_df['order_date_time'], errors='coerce', format='ISO8601'),
+        'total_amount': pd.to_numeric(raw_df['total_amount'], errors='coerce'),
+    }
+
+    conditions, reasons = [], []
+    for column in REQUIRED_ORDER_FIELDS:
+        # An absent element reads as None, an empty one as ''
+        conditions.append((raw_df[column].isna() | (raw_df[column].str.strip() == '')).to_numpy())
+        reasons.append(f'missing_{column}')
+    # Values that are present but don't parse (missing ones were caught above)
+    for column, dtype in INTEGER_COLUMNS.items():
+        values = parsed[column]
+        limits = np.iinfo(dtype)
+        # 'max + 1' as a float is exact, unlike max itself for int64
+        in_range = (values >= limits.min) & (values < float(limits.max) + 1)
+        conditions.append((values.isna() | (values != values.round()) | ~in_range).to_numpy())
+        reasons.append(f'bad_{column}')
+    for column in VALUE_COLUMNS:
+        conditions.append(parsed[column].isna().to_numpy())
+        reasons.append(f'bad_{column}')
+    conditions.append((parsed['sku_count'] <= 0).to_numpy())
+    reasons.append('non_positive_sku_count')
+
+    reason = np.select(conditions, reasons, default=None)
+    return parsed, reason
+
+
+def parse_customer_fields(raw_df):
+    """
+    Parses the raw (string) mobile numbers of the customers without raising on bad values.
+    Returns (parsed mobile numbers, reason per row or None).
+    """
+    mobile_numbers = pd.to_numeric(raw_df['mobile_number'], errors='coerce')
+    is_missing = raw_df['mobile_number'].isna().to_numpy()
+    is_bad = (mobile_numbers.isna() | (mobile_numbers != mobile_numbers.round())).to_numpy()
+    # customer_dim has one row per mobile number; the first valid row of a number is kept
+    is_valid = ~(is_missing | is_bad)
+    is_duplicate = mobile_numbers.where(is_valid).duplicated().to_numpy() & is_valid
+    reason = np.select(
+        [is_missing, is_bad, is_duplicate],
+        ['missing_mobile_number', 'bad_mobile_number', 'duplicate_mobile_number'], default=None
+    )
+    return mobile_numbers, reason
+
+
+def find_bad_orders(unique_orders_df, customer_numbers):
+    """
+    Order-level checks on the combined order headers (one row per distinct header), given
+    the mobile numbers of the customers as a unique Index. Returns the reason per header
+    row, or None.
+    """
+    # After exact duplicates are gone, an order_id that is still repeated has conflicting headers
+    is_conflicting = unique_orders_df['order_id'].duplicated(keep=False).to_numpy()
+    # The Index builds its hash table once, which matters when this runs once per chunk
+    is_orphan = customer_numbers.get_indexer(unique_orders_df['mobile_number']) < 0
+    return np.select(
+        [is_conflicting, is_orphan], ['conflicting_order_header', 'orphan_mobile_number'], default=None
+    )
+
+
+def quarantine_orders(unique_orders_df, order_items_df, customers_df):
+    """
+    Drops the orders that fail an order-level check, and all of their items, and the
+    repeated lines of one SKU within an order (the first line is kept).
+    Returns (unique_orders_df, order_items_df, list of rejected frames with a 'reason' column).
+    """
+    reason = find_bad_orders(unique_orders_df, pd.Index(customers_df['mobile_number']).unique())
+    is_bad = reason != None  # noqa: E711 (element-wise on an object array)
+    rejected = []
+    if is_bad.any():
+        rejected.append(unique_orders_df[is_bad].assign(reason=reason[is_bad]))
+        bad_order_ids = rejected[0]['order_id'].unique()
+        # A conflicting order is dropped as a whole, including its header variants that look fine
+        unique_orders_df = unique_orders_df[~unique_orders_df['order_id'].isin(bad_order_ids)].reset_index(drop=True)
+        order_items_df = order_items_df[~order_items_df['order_id'].isin(bad_order_ids)].reset_index(drop=True)
+
+    # order_items is keyed on (order, SKU), so a second line of the same SKU can't be loaded
+    is_duplicate_item = order_items_df.duplicated(['order_id', 'sku_id']).to_numpy()
+    if is_duplicate_item.any():
+        rejected.append(order_items_df[is_duplicate_item].assign(reason='duplicate_order_item'))
+        order_items_df = order_items_df[~is_duplicate_item].reset_index(drop=True)
+    return unique_orders_df, order_items_df, rejected
+
+
+def write_quarantine(rejected_frames, kind='orders', quarantine_dir=QUARANTINE_DIR):
+    """
+    Writes the rejected rows (frames with a 'reason' column) of one input ('orders' or
+    'customers') to one CSV for this run, reason first. Prints a count per reason and
+    returns the file path (None if nothing was rejected).
+    """
+    rejected_frames = [df for df in rejected_frames if len(df)]
+    if not rejected_frames:
+        return None
+    rejected_df = pd.concat(rejected_frames, ignore_index=True)
+    rejected_df = rejected_df[['reason', *[column for column in rejected_df.columns if column != 'reason']]]
+
+    os.makedirs(quarantine_dir, exist_ok=True)
+    path = os.path.join(quarantine_dir, f"rejected_{kind}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}.csv")
+    rejected_df.to_csv(path, index=False)
+
+    counts = rejected_df['reason'].value_counts()
+    print(f"Quarantined {len(rejected_df)} rows to {path}: "
+          + ", ".join(f"{reason}={count}" for reason, count in counts.items()))
+    return path
@@ -1,34 +1,255 @@
 import os
+import re
+import sqlite3
 import sys
-import sqlalchemy
-from dotenv import load_dotenv
+import threading
+import time
+from datetime import datetime
 
-# Load .env file from the parent directory
-load_dotenv() 
+# pandas, SQLAlchemy and dotenv are imported inside the functions that use them, so
+# importing this module (e.g. for a pandas-only run or a --help) costs almost nothing.
+# Settings are read from the environment / .env only when a connection is made.
 
-# READ credentials from the environment
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASS")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
+# Which SQL engine runs the KPIs (env DB_BACKEND): 'mysql' (server), or an embedded
+# in-process engine, 'duckdb' (columnar, scans DataFrames/files in place) or
+# 'sqlite' (copies the frames in)
+EMBEDDED_BACKENDS = ('duckdb', 'sqlite')
+# Database file of the embedded engine (env EMBEDDED_DB_PATH; ':memory:' = nothing written to disk)
+DEFAULT_EMBEDDED_DB_PATH = ':memory:'
 
-def create_db_engine():
+# Connection pool settings. The pool must be at least as big as the number of
+# queries we run at the same time (4 KPI queries).
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 5
+DB_POOL_RECYCLE_SECONDS = 1800
+
+# Retry settings for transient connection errors (waits 1s, 2s, 4s, ...)
+DB_MAX_RETRIES = 3
+DB_RETRY_BACKOFF_SECONDS = 1.0
+
+
+_settings_loaded = False
+
+
+def _load_settings():
+    """
+    Loads the .env file into the environment (once).
+    """
+    global _settings_loaded
+    if not _settings_loaded:
+        from dotenv import load_dotenv
+
+        # Load .env file from the parent directory
+        load_dotenv()
+        _settings_loaded = True
+
+
+def get_db_backend(backend=None):
+    """
+    The configured SQL backend: 'backend' if given, else DB_BACKEND from the environment / .env.
+    """
+    _load_settings()
+    return (backend or os.getenv("DB_BACKEND", "mysql")).lower()
+
+
+def run_with_retries(func, max_retries=DB_MAX_RETRIES, backoff_seconds=DB_RETRY_BACKOFF_SECONDS):
+    """
+    Calls func() and retries it with exponential backoff if the database connection fails.
+    Only OperationalError (lost/refused connections) is retried; other errors are raised at once.
+    """
+    import sqlalchemy
+
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except sqlalchemy.exc.OperationalError as e:
+            if attempt == max_retries:
+                raise
+            wait_seconds = backoff_seconds * (2 ** attempt)
+            print(f"Database error ({e.__class__.__name__}), retrying in {wait_seconds:.0f}s...")
+            time.sleep(wait_seconds)
+
+
+def _test_connection(engine):
+    import sqlalchemy
+
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1"))
+
+
+class EmbeddedBackend:
+    """
+    An in-process SQL engine (DuckDB or SQLite) the KPI queries can run on without a server.
+
+    Tables are registered from DataFrames, or from Parquet / Arrow files (e.g. the parse
+    cache). DuckDB scans them where they are, without copying; SQLite has no such scan,
+    so the data is copied into its (in-memory) database once. Queries use the same
+    ':name' bound parameters as SQLAlchemy text(), so one SQL string works everywhere.
+    """
+
+    def __init__(self, backend='duckdb', database=DEFAULT_EMBEDDED_DB_PATH):
+        if backend not in EMBEDDED_BACKENDS:
+            raise ValueError(f"Unknown embedded backend '{backend}', expected one of {EMBEDDED_BACKENDS}.")
+        self.dialect = backend
+        self._versions = {}
+        self._lock = threading.Lock()
+        if backend == 'duckdb':
+            import duckdb
+            self.conn = duckdb.connect(database)
+        else:
+            self.conn = sqlite3.connect(database, check_same_thread=False)
+
+    def register(self, table_name, source):
+        """
+        Makes 'source' (a DataFrame, or a .parquet / .arrow file path) queryable as 'table_name'.
+        """
+        import pandas as pd
+
+        if isinstance(source, pd.DataFrame):
+            self._versions[table_name] = source.attrs.get('data_version')
+        else:
+            self._versions[table_name] = f"{source}:{os.stat(source).st_mtime_ns}"
+
+        with self._lock:
+            if self.dialect == 'duckdb':
+                if isinstance(source, pd.DataFrame):
+                    self.conn.register(table_name, source)
+                elif source.endswith('.parquet'):
+                    self.conn.execute(
+                        f"CREATE OR REPLACE VIEW {table_name} AS SELECT * FROM read_parquet('{source}')"
+                    )
+                else:
+                    from pyarrow import feather
+                    self.conn.register(table_name, feather.read_table(source, memory_map=True))
+            else:
+                if not isinstance(source, pd.DataFrame):
+                    source = pd.read_parquet(source) if source.endswith('.parquet') else pd.read_feather(source)
+                source.to_sql(table_name, self.conn, if_exists='replace', index=False)
+
+    def write_table(self, table_name, df, append=False):
+        """
+        Stores 'df' as a real table in the embedded database (replaced, or appended to),
+        e.g. for the sql sink. Unlike register(), the rows are copied.
+        """
+        with self._lock:
+            if self.dialect == 'duckdb':
+                self.conn.register('_write_table_source', df)
+                try:
+                    if append:
+                        self.conn.execute(f"INSERT INTO {table_name} SELECT * FROM _write_table_source")
+                    else:
+                        self.conn.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM _write_table_source")
+                finally:
+                    self.conn.unregister('_write_table_source')
+            else:
+                df.to_sql(table_name, self.conn, if_exists='append' if append else 'replace', index=False)
+
+    @property
+    def data_version(self):
+        """
+        The versions of every registered table, or None if any of them is unknown.
+        """
+        if not self._versions or None in self._versions.values():
+            return None
+        return tuple(sorted(self._versions.items()))
+
+    def query(self, sql, params=None):
+        """
+        Runs one query and returns the result as a DataFrame.
+        """
+        import pandas as pd
+
+        params = params or {}
+        if self.dialect == 'duckdb':
+            # DuckDB spells named parameters '$name'. Registered frames are only visible on
+            # this connection, so queries take turns (each one already uses every core).
+            with self._lock:
+                return self.conn.execute(re.sub(r'(?<!:):(\w+)', r'$\1', sql), params).df()
+
+        # SQLite stores timestamps as ISO text, so datetime parameters are compared as text
+        params = {
+            key: str(pd.Timestamp(value)) if isinstance(value, datetime) else value
+            for key, value in params.items()
+        }
+        with self._lock:
+            return pd.read_sql(sql, self.conn, params=params)
+
+    def query_chunks(self, sql, params=None, chunk_size=50_000):
+        """
+        Runs one query and yields the result in DataFrames of at most 'chunk_size' rows,
+        fetched batch by batch. The connection is held until the generator is exhausted.
+        """
+        import pandas as pd
+
+        params = params or {}
+        with self._lock:
+            if self.dialect == 'duckdb':
+                result = self.conn.execute(re.sub(r'(?<!:):(\w+)', r'$\1', sql), params)
+                reader = result.fetch_record_batch(chunk_size)
+                empty = True
+                for batch in reader:
+                    empty = False
+                    yield batch.to_pandas()
+                if empty:
+                    # Keep the columns of an empty result, like pd.read_sql does
+                    yield reader.schema.empty_table().to_pandas()
+            else:
+                params = {
+                    key: str(pd.Timestamp(value)) if isinstance(value, datetime) else value
+                    for key, value in params.items()
+                }
+                yield from pd.read_sql(sql, self.conn, params=params, chunksize=chunk_size)
+
+
+def create_embedded_backend(backend=None, database=None):
+    backend = get_db_backend(backend)
+    database = database or os.getenv("EMBEDDED_DB_PATH", DEFAULT_EMBEDDED_DB_PATH)
+    try:
+        return EmbeddedBackend(backend, database)
+    except ImportError:
+        print(f"Error: '{backend}' library not found. Please install it or set DB_BACKEND=mysql.")
+        sys.exit(1)
+
+
+def create_db_engine(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, backend=None):
     """
     Creates a SQLAlchemy engine to connect to the MySQL database.
+    The engine keeps a pool of connections that are checked (pre-ping) before each use,
+    so it can be shared by queries running in parallel threads.
+    With DB_BACKEND=duckdb or sqlite (or backend=...) it returns an EmbeddedBackend instead.
     """
+    backend = get_db_backend(backend)
+    if backend in EMBEDDED_BACKENDS:
+        print(f"Using the embedded '{backend}' SQL backend.")
+        return create_embedded_backend(backend)
+
+    # READ credentials from the environment
+    db_user = os.getenv("DB_USER")
+    db_pass = os.getenv("DB_PASS")
+    db_host = os.getenv("DB_HOST")
+    db_port = os.getenv("DB_PORT")
+    db_name = os.getenv("DB_NAME")
+
     try:
+        import sqlalchemy
+
         # Check if any credentials are None
-        if not all([DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME]):
+        if not all([db_user, db_pass, db_host, db_port, db_name]):
             print("Error: Database credentials are not fully set in .env file.")
             sys.exit(1)
 
-        connection_string = f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}:{int(DB_PORT)}/{DB_NAME}"
-        engine = sqlalchemy.create_engine(connection_string)
-        
+        connection_string = f"mysql+mysqlconnector://{db_user}:{db_pass}@{db_host}:{int(db_port)}/{db_name}"
+        engine = sqlalchemy.create_engine(
+            connection_string,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS
+        )
+
         # Test the connection
-        with engine.connect() as conn:
-            print("Successfully connected to MySQL database.")
+        run_with_retries(lambda: _test_connection(engine))
+        print("Successfully connected to MySQL database.")
         return engine
     except ImportError:
         print("Error: 'mysql-connector-python' library not found. Please install it.")
@@ -37,4 +258,4 @@ def create_db_engine():
         print(f"Error connecting to database: {e}")
         print("---")
         print("Please check your DB_USER, DB_PASS, DB_NAME and that MySQL is running.")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
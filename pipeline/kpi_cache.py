@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- CONSTANTS ---
+# How many KPI results we keep, and for how long (seconds) a result may be served
+KPI_CACHE_MAX_ENTRIES = 256
+KPI_CACHE_TTL_SECONDS = 15 * 60
+
+
+class KpiResultCache:
+    """
+    A small thread-safe LRU + TTL cache for KPI results.
+
+    Keys are built from the KPI source ('sql' / 'memory' / 'service'), the KPI name, its
+    parameters (e.g. the 30-day window) and the data version. Loaders bump the data version,
+    so a new load never serves stale results; the TTL only bounds how long a result lives.
+    Cached DataFrames are shared between callers and should be treated as read-only.
+    """
+
+    def __init__(self, max_entries=KPI_CACHE_MAX_ENTRIES, ttl_seconds=KPI_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(source, kpi_name, params, data_version):
+        return (source, kpi_name, tuple(sorted((params or {}).items())), data_version)
+
+    def get(self, key):
+        """
+        Returns the cached value, or None on a miss (unknown or expired key).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# Shared by the SQL and in-memory KPI paths and the KPI service in this process
+KPI_RESULT_CACHE = KpiResultCache()
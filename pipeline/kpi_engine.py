@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from pipeline.metrics import track_stage
+from pipeline.surrogate_keys import key_positions
+
+
+def factorize_sorted(values):
+    """
+    Returns (codes, uniques) with uniques sorted, like the group keys of a pandas groupby.
+    Missing values get code -1. Categorical columns keep their own categories.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values, sort=True)
+
+
+def compute_kpis_vectorized(customers_df, unique_orders_df, since):
+    """
+    Computes all 4 KPIs with NumPy reductions over the orders arrays, without merging.
+
+    Each order's customer_key is looked up once in a dense key -> row array. The integer
+    positions this gives (-1 for unknown customers) are used to gather customer
+    attributes, and every KPI is one bincount over integer codes. 'since' is the start
+    of the KPI 4 window. Customers must have unique keys (i.e. unique mobile numbers).
+
+    Returns {kpi_name: DataFrame}, identical to pandas_analysis.compute_in_memory_kpis.
+    """
+    # --- One lookup of customer_key against the customer table ---
+    with track_stage('mem_kpi.prepare', rows_in=len(unique_orders_df)):
+        customer_pos = key_positions(customers_df['customer_key'], unique_orders_df['customer_key'])
+        has_customer = customer_pos >= 0
+
+        name_codes, names = factorize_sorted(customers_df['customer_name'])
+        region_codes, regions = factorize_sorted(customers_df['region'])
+
+        # Customer attributes per order (-1 = no customer / missing value)
+        order_name = np.where(has_customer, name_codes[customer_pos], -1)
+        order_region = np.where(has_customer, region_codes[customer_pos], -1)
+
+        amounts = unique_orders_df['total_amount'].to_numpy()
+        order_times = unique_orders_df['order_date_time'].to_numpy()
+
+    def grouped_sum(codes, size, mask=None):
+        valid = codes >= 0 if mask is None else (codes >= 0) & mask
+        counts = np.bincount(codes[valid], minlength=size)
+        sums = np.bincount(codes[valid], weights=amounts[valid], minlength=size)
+        return counts, sums.astype(amounts.dtype)
+
+    # KPI 1: Repeat Customers
+    with track_stage('mem_kpi.kpi_1', rows_in=len(unique_orders_df)):
+        name_counts, _ = grouped_sum(order_name, len(names))
+        is_repeat = name_counts > 1
+        kpi_1_df = pd.DataFrame({
+            'customer_name': names[is_repeat],
+            'order_count': name_counts[is_repeat],
+        })
+
+    # KPI 2: Monthly Order Trends (every month from the first to the last order, like resample)
+    with track_stage('mem_kpi.kpi_2', rows_in=len(unique_orders_df)):
+        order_months = order_times.astype('datetime64[M]')
+        has_date = ~np.isnat(order_months)
+        month_numbers = order_months[has_date].astype(np.int64)
+        if len(month_numbers):
+            first_month = month_numbers.min()
+            month_codes = np.full(len(order_months), -1, dtype=np.int64)
+            month_codes[has_date] = month_numbers - first_month
+            month_count = int(month_numbers.max() - first_month + 1)
+            month_orders, month_revenue = grouped_sum(month_codes, month_count)
+            month_labels = np.arange(first_month, first_month + month_count).astype('datetime64[M]').astype(str)
+        else:
+            month_orders, month_revenue = np.array([], dtype=np.int64), np.array([], dtype=amounts.dtype)
+            month_labels = np.array([], dtype=object)
+        kpi_2_df = pd.DataFrame(
+            {'total_orders': month_orders, 'total_revenue': month_revenue},
+            index=pd.Index(month_labels, dtype=object, name='order_date_time')
+        )
+
+    # KPI 3: Regional Revenue (only regions that have orders, like observed=True)
+    with track_stage('mem_kpi.kpi_3', rows_in=len(unique_orders_df)):
+        region_orders, region_revenue = grouped_sum(order_region, len(regions))
+        has_orders = region_orders > 0
+        if isinstance(customers_df['region'].dtype, pd.CategoricalDtype):
+            region_values = pd.Categorical.from_codes(np.flatnonzero(has_orders), dtype=customers_df['region'].dtype)
+        else:
+            region_values = regions[has_orders]
+        kpi_3_df = pd.DataFrame({'region': region_values, 'total_revenue': region_revenue[has_orders]})
+
+    # KPI 4: Top Customers by Spend (Last 30 Days)
+    with track_stage('mem_kpi.kpi_4', rows_in=len(unique_orders_df)):
+        in_window = order_times >= np.datetime64(pd.Timestamp(since))
+        window_orders, window_spend = grouped_sum(order_name, len(names), mask=in_window)
+        has_window_orders = window_orders > 0
+        kpi_4_df = pd.DataFrame({
+            'customer_name': names[has_window_orders],
+            'total_spend': window_spend[has_window_orders],
+        })
+
+    return {
+        'kpi_1': kpi_1_df,
+        'kpi_2': kpi_2_df,
+        'kpi_3': kpi_3_df.sort_values(by='total_revenue', ascending=False),
+        'kpi_4': kpi_4_df.sort_values(by='total_spend', ascending=False).head(10),
+    }
+
+
+def kpis_from_customer_totals(customers_df, totals, month_labels, month_orders, month_revenue):
+    """
+    Builds the 4 KPIs from totals that were already reduced per customer, e.g. by the
+    partitioned or sharded engines:
+
+        totals          {'order_count', 'spend', 'window_count', 'window_spend'}: one array
+                        each, aligned with the rows of customers_df (KPI 4 window = window_*)
+        month_*         'YYYY-MM' labels of every month from the first to the last order,
+                        with the order count and revenue of each
+
+    Returns {kpi_name: DataFrame}, identical to compute_kpis_vectorized.
+    """
+    name_codes, names = factorize_sorted(customers_df['customer_name'])
+    region_codes, regions = factorize_sorted(customers_df['region'])
+
+    def by_code(codes, size, values):
+        valid = codes >= 0
+        return np.bincount(codes[valid], weights=np.asarray(values)[valid], minlength=size)
+
+    # KPI 1: Repeat Customers
+    name_counts = by_code(name_codes, len(names), totals['order_count']).astype(np.int64)
+    is_repeat = name_counts > 1
+    kpi_1_df = pd.DataFrame({'customer_name': names[is_repeat], 'order_count': name_counts[is_repeat]})
+
+    # KPI 2: Monthly Order Trends
+    kpi_2_df = pd.DataFrame(
+        {'total_orders': np.asarray(month_orders, dtype=np.int64), 'total_revenue': np.asarray(month_revenue)},
+        index=pd.Index(np.asarray(month_labels), dtype=object, name='order_date_time')
+    )
+
+    # KPI 3: Regional Revenue (only regions that have orders, like observed=True)
+    region_orders = by_code(region_codes, len(regions), totals['order_count'])
+    region_revenue = by_code(region_codes, len(regions), totals['spend'])
+    has_orders = region_orders > 0
+    if isinstance(customers_df['region'].dtype, pd.CategoricalDtype):
+        region_values = pd.Categorical.from_codes(np.flatnonzero(has_orders), dtype=customers_df['region'].dtype)
+    else:
+        region_values = regions[has_orders]
+    kpi_3_df = pd.DataFrame({'region': region_values, 'total_revenue': region_revenue[has_orders]})
+
+    # KPI 4: Top Customers by Spend (Last 30 Days)
+    name_window_orders = by_code(name_codes, len(names), totals['window_count'])
+    name_window_spend = by_code(name_codes, len(names), totals['window_spend'])
+    has_window_orders = name_window_orders > 0
+    kpi_4_df = pd.DataFrame({
+        'customer_name': names[has_window_orders],
+        'total_spend': name_window_spend[has_window_orders],
+    })
+
+    return {
+        'kpi_1': kpi_1_df,
+        'kpi_2': kpi_2_df,
+        'kpi_3': kpi_3_df.sort_values(by='total_revenue', ascending=False),
+        'kpi_4': kpi_4_df.sort_values(by='total_spend', ascending=False).head(10),
+    }
@@ -0,0 +1,247 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from pipeline.data_processor import (
+    ORDER_CHUNK_SIZE, ORDER_HEADER_COLUMNS, ORDER_PARSE_WORKERS, iter_order_chunks, read_customers,
+    resolve_order_files
+)
+from pipeline.data_quality import find_bad_orders, write_quarantine
+from pipeline.metrics import track_stage
+from pipeline.pandas_analysis import thirty_days_before
+from pipeline.sinks import write_kpis
+
+# Per-customer state columns: all orders, and the orders inside the KPI 4 window
+CUSTOMER_STATE_COLUMNS = ['order_count', 'total_spend', 'window_count', 'window_spend']
+MONTH_STATE_COLUMNS = ['total_orders', 'total_revenue']
+
+
+class KpiPartialState:
+    """
+    Mergeable partial aggregates for the 4 KPIs, built from order chunks:
+
+        per customer (mobile_number)  order count, spend, order count and spend in the KPI 4 window
+        per month                     order count, revenue
+
+    Regional revenue is the per-customer spend summed by the customer's region, so it
+    needs no state of its own. The per-customer state is one dense array row per known
+    customer, so a chunk only touches the rows of its own orders. The state grows with
+    the number of customers and months, not with the number of orders. States of
+    different chunk streams (e.g. files) of the same customers can be combined with
+    merge(); finalize() turns a state into the KPIs.
+
+    Chunks are order *item* rows. An order's items are expected to be next to each other
+    in the stream (as in the XML export), so the first and the last order of the stream
+    so far are held back until it is known whether they continue in the next chunk, or
+    in the next stream for merge() (merge the states in stream order). Every order is
+    checked like data_quality.quarantine_orders before it is counted: orders of unknown
+    mobile numbers and orders whose items disagree on the header are left out and kept
+    in 'rejected'. Header conflicts are only seen between items next to each other.
+    """
+
+    def __init__(self, since, customer_numbers):
+        self.since = np.datetime64(pd.Timestamp(since))
+        self.customer_numbers = pd.Index(customer_numbers).unique()
+        # Row i belongs to customer_numbers[i], columns as CUSTOMER_STATE_COLUMNS
+        self.customer_totals = np.zeros((len(self.customer_numbers), len(CUSTOMER_STATE_COLUMNS)))
+        self.months = pd.DataFrame(columns=MONTH_STATE_COLUMNS, index=pd.DatetimeIndex([]), dtype='float64')
+        self.order_rows = 0
+        # Rejected rows (raw item rows and order headers), with a 'reason' column
+        self.rejected = []
+        # Header rows of the first and the last order_id of the stream, not counted yet
+        self._head = None
+        self._tail = None
+
+    def update(self, chunk):
+        """
+        Adds one chunk of order item rows to the state.
+        """
+        self._push(chunk[ORDER_HEADER_COLUMNS].drop_duplicates())
+        return self
+
+    def _push(self, orders):
+        """
+        Takes the next header rows of the stream and counts the orders that can no longer
+        continue (all but the last one, and the first one of the stream).
+        """
+        if orders.empty:
+            return
+        if self._tail is not None:
+            # The first order of these rows may be the last order of the previous ones
+            orders = pd.concat([self._tail, orders], ignore_index=True).drop_duplicates()
+        is_tail = (orders['order_id'] == orders['order_id'].iloc[-1]).to_numpy()
+        self._tail = orders[is_tail]
+        closed = orders[~is_tail]
+        if self._head is None and len(closed):
+            is_head = (closed['order_id'] == closed['order_id'].iloc[0]).to_numpy()
+            self._head, closed = closed[is_head], closed[~is_head]
+        self._add_checked_orders(closed)
+
+    def _add_checked_orders(self, orders):
+        """
+        Rejects the header rows that fail an order-level check and counts the others.
+        """
+        reason = find_bad_orders(orders, self.customer_numbers)
+        is_bad = reason != None  # noqa: E711 (element-wise on an object array)
+        if is_bad.any():
+            self.rejected.append(orders[is_bad].assign(reason=reason[is_bad]))
+            orders = orders[~is_bad]
+        self._add_orders(orders)
+
+    def _add_orders(self, orders):
+        """
+        Adds the header rows 'orders' (one per order) to the aggregates.
+        """
+        self.order_rows += len(orders)
+
+        amounts = orders['total_amount'].to_numpy()
+        order_times = orders['order_date_time'].to_numpy()
+        in_window = order_times >= self.since
+
+        # Orphans were rejected, so every order has a customer row. add.at only touches those
+        # rows; aligning a per-customer frame would cost O(customers) per chunk.
+        customer_pos = self.customer_numbers.get_indexer(orders['mobile_number'])
+        np.add.at(self.customer_totals, customer_pos, np.column_stack([
+            np.ones(len(orders)), amounts, in_window, np.where(in_window, amounts, 0.0)
+        ]))
+
+        month_part = pd.DataFrame({
+            'total_orders': 1.0,
+            'total_revenue': amounts,
+        }, index=order_times.astype('datetime64[M]')).groupby(level=0).sum()
+
+        self.months = self.months.add(month_part, fill_value=0)
+
+    def merge(self, other):
+        """
+        Combines the state of the stream that follows this one (same window and customers)
+        into this one.
+        """
+        if not self.customer_numbers.equals(other.customer_numbers):
+            raise ValueError("Partial states of different customers can't be merged.")
+        self.customer_totals += other.customer_totals
+        self.months = self.months.add(other.months, fill_value=0)
+        self.order_rows += other.order_rows
+        self.rejected.extend(other.rejected)
+        # The orders the other stream held back continue this stream, in this order
+        for orders in (other._head, other._tail):
+            if orders is not None:
+                self._push(orders)
+        return self
+
+    @property
+    def customers(self):
+        """
+        The per-customer state as a DataFrame indexed by mobile_number, customers with orders only.
+        """
+        has_orders = self.customer_totals[:, 0] > 0
+        return pd.DataFrame(
+            self.customer_totals[has_orders], columns=CUSTOMER_STATE_COLUMNS,
+            index=self.customer_numbers[has_orders]
+        )
+
+    def close(self):
+        """
+        Ends the stream: counts the orders that were held back. No chunks or merges after this.
+        """
+        pending = [orders for orders in (self._head, self._tail) if orders is not None]
+        self._head = self._tail = None
+        if pending:
+            self._add_checked_orders(pd.concat(pending, ignore_index=True))
+
+    def finalize(self, customers_df):
+        """
+        Joins the per-customer state to the customers and returns {kpi_name: DataFrame},
+        shaped like pandas_analysis.compute_in_memory_kpis. Closes the state first.
+        """
+        self.close()
+        customer_state = self.customers.rename_axis('mobile_number').reset_index()
+        for column in ['order_count', 'window_count']:
+            customer_state[column] = customer_state[column].astype('int64')
+        merged_df = pd.merge(customer_state, customers_df, on='mobile_number', how='inner')
+
+        # KPI 1: Repeat Customers
+        customer_order_counts = merged_df.groupby('customer_name')['order_count'].sum()
+        kpi_1_df = customer_order_counts[customer_order_counts > 1].reset_index(name='order_count')
+
+        # KPI 2: Monthly Order Trends (every month from the first to the last order, like resample)
+        months = self.months
+        if len(months):
+            months = months.reindex(pd.date_range(months.index.min(), months.index.max(), freq='MS'), fill_value=0)
+        kpi_2_df = pd.DataFrame({
+            'total_orders': months['total_orders'].astype('int64').to_numpy(),
+            'total_revenue': months['total_revenue'].to_numpy(),
+        }, index=pd.Index(months.index.strftime('%Y-%m'), dtype=object, name='order_date_time'))
+
+        # KPI 3: Regional Revenue
+        kpi_3_df = merged_df.groupby('region', observed=True)['total_spend'].sum().reset_index(name='total_revenue')
+
+        # KPI 4: Top Customers by Spend (Last 30 Days)
+        window_df = merged_df[merged_df['window_count'] > 0]
+        kpi_4_df = window_df.groupby('customer_name')['window_spend'].sum().reset_index(name='total_spend')
+
+        return {
+            'kpi_1': kpi_1_df,
+            'kpi_2': kpi_2_df,
+            'kpi_3': kpi_3_df.sort_values(by='total_revenue', ascending=False),
+            'kpi_4': kpi_4_df.sort_values(by='total_spend', ascending=False).head(10),
+        }
+
+
+def compute_partial_state(order_file, since, customer_numbers, chunk_size=ORDER_CHUNK_SIZE):
+    """
+    Streams one order file into a KpiPartialState ('customer_numbers': the mobile numbers
+    of the valid customers). Runs in a worker process per file.
+    """
+    state = KpiPartialState(since, customer_numbers)
+    for chunk in iter_order_chunks(order_file, chunk_size, rejected=state.rejected):
+        state.update(chunk)
+    return state
+
+
+def run_chunked_kpi_analysis(customer_file, order_file, chunk_size=ORDER_CHUNK_SIZE,
+                             max_workers=ORDER_PARSE_WORKERS, sink=None):
+    """
+    Out-of-core version of run_in_memory_kpi_analysis: the orders are never held in memory
+    at once. Each order file is streamed chunk by chunk into a partial state (several files
+    in parallel in a process pool), the states are merged and then joined to the customers.
+    Memory is bounded by the number of customers and 'chunk_size'. The results are written
+    to 'sink' (default: stdout). Returns {kpi_name: DataFrame}.
+    """
+    print("\n--- Starting Requirement B (In-Memory Approach): Running Chunked KPI Aggregation ---")
+    order_files = resolve_order_files(order_file)
+    if not order_files:
+        print(f"Error: No order files found at {order_file}")
+        sys.exit(1)
+    since = thirty_days_before()
+
+    try:
+        # The customers come first: orders of unknown mobile numbers are dropped while streaming
+        customers_df, rejected_customers_df = read_customers(customer_file)
+        customer_numbers = customers_df['mobile_number']
+        with track_stage('mem_kpi.chunked_orders') as record:
+            if len(order_files) == 1:
+                states = [compute_partial_state(order_files[0], since, customer_numbers, chunk_size)]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    states = list(pool.map(
+                        compute_partial_state, order_files, [since] * len(order_files),
+                        [customer_numbers] * len(order_files), [chunk_size] * len(order_files)
+                    ))
+            state = states[0]
+            for other in states[1:]:
+                state.merge(other)
+            state.close()
+            record['rows_out'] = state.order_rows
+    except FileNotFoundError as e:
+        print(f"Error: Input file not found at {e.filename}")
+        sys.exit(1)
+    write_quarantine([rejected_customers_df], kind='customers')
+    write_quarantine(state.rejected)
+
+    print(f"Aggregated {state.order_rows} orders from {len(order_files)} file(s) "
+          f"into {len(state.customers)} customer states.")
+    with track_stage('mem_kpi.chunked_finalize', rows_in=len(state.customers)):
+        kpis = state.finalize(customers_df)
+    write_kpis(kpis, sink)
+    return kpis
@@ -0,0 +1,167 @@
+"""
+Multi-core version of the in-memory KPIs.
+
+The orders are hash-partitioned by customer into KPI_SHARDS shards, and each shard is
+reduced in its own process. The order columns are copied once into shared memory in shard
+order; workers attach to it and only receive (name, offset) pairs, so no order data is
+pickled. Each worker returns its customers' totals and its partial monthly sums, and
+kpi_engine.kpis_from_customer_totals combines them into the same KPIs as the serial engine.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from pipeline.kpi_engine import kpis_from_customer_totals
+from pipeline.metrics import track_stage
+
+# --- CONSTANTS ---
+# Shards (and worker processes) for the sharded KPI engine
+KPI_SHARDS = os.cpu_count() or 1
+
+# Below this many orders the process start-up costs more than the work, so one shard is used
+MIN_ORDERS_PER_SHARD = 200_000
+
+# Order columns shared with the workers, and the dtype each is stored with
+SHARED_COLUMNS = {
+    'customer_key': np.int64,
+    'order_date_time': np.int64,   # nanoseconds since the epoch, NaT = INT64_MIN
+    'total_amount': np.float64,
+}
+NAT = np.iinfo(np.int64).min
+
+
+def _attach(block_name, dtype, length):
+    """
+    Opens a shared block created by the parent as a NumPy array (no copy).
+    """
+    # Pool workers share the parent's resource tracker, and the parent unlinks the block
+    block = shared_memory.SharedMemory(name=block_name)
+    return block, np.ndarray(length, dtype=dtype, buffer=block.buf)
+
+
+def _reduce_orders(keys, times, amounts, n_shards, since, first_month, month_count):
+    """
+    Reduces the orders of one shard. Customer totals are indexed by customer_key // n_shards,
+    so a shard only returns arrays for its own customers.
+    """
+    local_keys = keys // n_shards
+    size = int(local_keys.max(initial=-1)) + 1
+    in_window = times >= since
+    totals = {
+        'order_count': np.bincount(local_keys, minlength=size),
+        'spend': np.bincount(local_keys, weights=amounts, minlength=size),
+        'window_count': np.bincount(local_keys[in_window], minlength=size),
+        'window_spend': np.bincount(local_keys[in_window], weights=amounts[in_window], minlength=size),
+    }
+
+    # Partial monthly sums; months are counted from the first month of all orders
+    has_date = times != NAT
+    month_codes = times[has_date].astype('datetime64[ns]').astype('datetime64[M]').astype(np.int64) - first_month
+    month_orders = np.bincount(month_codes, minlength=month_count)
+    month_revenue = np.bincount(month_codes, weights=amounts[has_date], minlength=month_count)
+    return totals, month_orders, month_revenue
+
+
+def _reduce_shard(blocks, length, start, stop, n_shards, since, first_month, month_count):
+    """
+    Worker: reduces rows [start, stop) of the shared columns, which all belong to one shard.
+    """
+    attached = {name: _attach(block_name, SHARED_COLUMNS[name], length) for name, block_name in blocks.items()}
+    try:
+        return _reduce_orders(
+            attached['customer_key'][1][start:stop], attached['order_date_time'][1][start:stop],
+            attached['total_amount'][1][start:stop], n_shards, since, first_month, month_count
+        )
+    finally:
+        # The arrays must be gone before their blocks can be closed
+        blocks = [block for block, _ in attached.values()]
+        attached.clear()
+        for block in blocks:
+            block.close()
+
+
+def _reduce_in_processes(keys, times, amounts, n_shards, since, first_month, month_count):
+    """
+    Copies the order columns into shared memory grouped by shard and reduces every shard
+    in its own process. Returns the shard results in shard order.
+    """
+    with track_stage('mem_kpi.shard', rows_in=len(keys)):
+        # Counting sort by shard (radix sort on small integers), then one gather per column
+        shard_of_order = (keys % n_shards).astype(np.uint16)
+        by_shard = np.argsort(shard_of_order, kind='stable')
+        offsets = np.searchsorted(shard_of_order[by_shard], np.arange(n_shards + 1))
+
+        blocks = {}
+        try:
+            for name, values in [('customer_key', keys), ('order_date_time', times), ('total_amount', amounts)]:
+                block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                blocks[name] = block
+                np.take(values, by_shard, out=np.ndarray(len(values), dtype=SHARED_COLUMNS[name], buffer=block.buf))
+            block_names = {name: block.name for name, block in blocks.items()}
+
+            with track_stage('mem_kpi.shard_reduce', rows_in=len(keys)):
+                with ProcessPoolExecutor(max_workers=n_shards) as pool:
+                    return list(pool.map(
+                        _reduce_shard,
+                        *zip(*[
+                            (block_names, len(keys), offsets[shard], offsets[shard + 1], n_shards,
+                             since, first_month, month_count)
+                            for shard in range(n_shards)
+                        ])
+                    ))
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+
+def compute_kpis_sharded(customers_df, unique_orders_df, since, n_shards=KPI_SHARDS,
+                         min_orders_per_shard=MIN_ORDERS_PER_SHARD):
+    """
+    Computes all 4 KPIs with the orders split by customer over 'n_shards' processes
+    (fewer if a shard would get under 'min_orders_per_shard' orders).
+    'since' is the start of the KPI 4 window. Customers must have unique keys.
+
+    Sharding is customer_key % n_shards. Surrogate keys are dense, so this spreads the
+    customers evenly like a hash of mobile_number would, and all orders of a customer
+    land in one shard.
+
+    Returns {kpi_name: DataFrame}, identical to kpi_engine.compute_kpis_vectorized.
+    """
+    n_shards = max(1, min(n_shards, len(unique_orders_df) // min_orders_per_shard))
+    keys = unique_orders_df['customer_key'].to_numpy(np.int64)
+    times = unique_orders_df['order_date_time'].to_numpy('datetime64[ns]').view(np.int64)
+
+    dated = times[times != NAT]
+    if len(dated):
+        first_month = dated.min().astype('datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+        last_month = dated.max().astype('datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+        month_count = int(last_month - first_month + 1)
+    else:
+        first_month, month_count = 0, 0
+
+    amounts = unique_orders_df['total_amount'].to_numpy(np.float64)
+    since_ns = np.datetime64(pd.Timestamp(since), 'ns').astype(np.int64)
+    if n_shards == 1:
+        with track_stage('mem_kpi.shard_reduce', rows_in=len(keys)):
+            results = [_reduce_orders(keys, times, amounts, 1, since_ns, first_month, month_count)]
+    else:
+        results = _reduce_in_processes(keys, times, amounts, n_shards, since_ns, first_month, month_count)
+
+    with track_stage('mem_kpi.combine', rows_in=len(customers_df)):
+        # Scatter each shard's totals back to global keys: key = local key * n_shards + shard
+        key_count = int(max(keys.max(initial=0), customers_df['customer_key'].max()) + 1)
+        by_key = {field: np.zeros(key_count) for field in ['order_count', 'spend', 'window_count', 'window_spend']}
+        month_orders = np.zeros(month_count, dtype=np.int64)
+        month_revenue = np.zeros(month_count)
+        for shard, (totals, shard_month_orders, shard_month_revenue) in enumerate(results):
+            for field, values in totals.items():
+                by_key[field][np.arange(len(values)) * n_shards + shard] = values
+            month_orders += shard_month_orders
+            month_revenue += shard_month_revenue
+
+        customer_keys = customers_df['customer_key'].to_numpy(np.int64)
+        customer_totals = {field: values[customer_keys] for field, values in by_key.items()}
+        month_labels = np.arange(first_month, first_month + month_count).astype('datetime64[M]').astype(str)
+        return kpis_from_customer_totals(customers_df, customer_totals, month_labels, month_orders, month_revenue)
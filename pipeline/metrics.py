@@ -0,0 +1,175 @@
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+# --- CONSTANTS ---
+# Where the run report is written (JSON for people, Prometheus textfile for the node exporter)
+METRICS_JSON_PATH = 'metrics/etl_metrics.json'
+METRICS_PROM_PATH = 'metrics/etl_metrics.prom'
+
+# Opt-in profiling: PIPELINE_PROFILE=all, or a comma-separated list of stage names
+# (e.g. "extract,load.orders"). Each profiled stage gets a cProfile dump and a tracemalloc summary.
+# Only one stage is profiled at a time: a stage that starts while another one is profiled
+# (e.g. 'extract.orders' inside 'extract') is covered by that profile instead of its own.
+PROFILE_STAGES = {name.strip() for name in os.getenv("PIPELINE_PROFILE", "").split(",") if name.strip()}
+PROFILE_DIR = 'metrics/profiles'
+
+# Stages can finish in several threads at once (scheduler, KPI thread pool)
+_records = []
+_records_lock = threading.Lock()
+
+# The stage being profiled, if any. A second cProfile would switch the first one off
+# (Python 3.12+ refuses to start it), and tracemalloc has only one peak to reset.
+_profiled_stage = None
+_profiler_lock = threading.Lock()
+
+
+def _profiling_enabled(stage):
+    return 'all' in PROFILE_STAGES or stage in PROFILE_STAGES
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is the process high-water mark, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _start_profiling(stage):
+    """
+    Starts cProfile and tracemalloc for 'stage', unless another stage is being profiled.
+    Returns (profiler, whether tracemalloc was started here), or None if not profiling.
+    """
+    global _profiled_stage
+    with _profiler_lock:
+        if _profiled_stage is not None:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool is active (Python 3.12+)
+            return None
+        _profiled_stage = stage
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    return profiler, started_tracemalloc
+
+
+def _stop_profiling(stage, profiling, record):
+    global _profiled_stage
+    profiler, started_tracemalloc = profiling
+    profiler.disable()
+    record['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    if started_tracemalloc:
+        tracemalloc.stop()
+    with _profiler_lock:
+        _profiled_stage = None
+    _write_profile(stage, profiler)
+
+
+@contextlib.contextmanager
+def track_stage(stage, rows_in=None):
+    """
+    Records wall time, CPU time (of the calling thread), rows in/out, rows/sec and
+    memory for the code inside the 'with' block. Set record['rows_out'] inside the block.
+
+    Memory is the process peak RSS at the end of the stage and how much the stage raised
+    it (0 if the stage stayed below an earlier peak; stages running at the same time share
+    the rise). Profiled stages also get their exact Python allocation peak (tracemalloc).
+
+        with track_stage('load.orders', rows_in=len(df)) as record:
+            ...
+            record['rows_out'] = written
+    """
+    record = {'stage': stage, 'rows_in': rows_in, 'rows_out': None}
+    profiling = _start_profiling(stage) if _profiling_enabled(stage) else None
+
+    peak_rss_start = _peak_rss_bytes()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.thread_time() - cpu_start
+        rows = record['rows_out'] if record['rows_out'] is not None else record['rows_in']
+        record['rows_per_second'] = rows / record['wall_seconds'] if rows and record['wall_seconds'] > 0 else None
+        record['peak_rss_bytes'] = _peak_rss_bytes()
+        record['peak_rss_growth_bytes'] = record['peak_rss_bytes'] - peak_rss_start
+
+        if profiling is not None:
+            _stop_profiling(stage, profiling, record)
+
+        with _records_lock:
+            _records.append(record)
+
+
+def _write_profile(stage, profiler):
+    """
+    Saves the cProfile stats of one stage (open with 'python -m pstats <file>' or snakeviz).
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_path = os.path.join(PROFILE_DIR, f"{stage}.prof")
+    profiler.dump_stats(profile_path)
+    print(f"[metrics] Profile for '{stage}' written to {profile_path}")
+
+
+def get_metrics():
+    """
+    Returns a copy of every stage record collected so far.
+    """
+    with _records_lock:
+        return [dict(record) for record in _records]
+
+
+def reset_metrics():
+    with _records_lock:
+        _records.clear()
+
+
+def _prometheus_lines(records):
+    metrics = [
+        ('wall_seconds', 'Wall-clock time per ETL stage in seconds.'),
+        ('cpu_seconds', 'CPU time of the stage thread in seconds.'),
+        ('rows_in', 'Rows going into the stage.'),
+        ('rows_out', 'Rows produced by the stage.'),
+        ('rows_per_second', 'Stage throughput in rows per second.'),
+        ('peak_rss_bytes', 'Process peak resident memory at the end of the stage.'),
+        ('peak_rss_growth_bytes', 'How much the stage raised the process peak resident memory.'),
+        ('tracemalloc_peak_bytes', 'Peak Python allocations during the stage (profiled stages only).'),
+    ]
+    lines = []
+    for field, help_text in metrics:
+        values = [(record['stage'], record[field]) for record in records if record.get(field) is not None]
+        if not values:
+            continue
+        lines.append(f"# HELP etl_stage_{field} {help_text}")
+        lines.append(f"# TYPE etl_stage_{field} gauge")
+        for stage, value in values:
+            lines.append(f'etl_stage_{field}{{stage="{stage}"}} {value}')
+    return lines
+
+
+def write_metrics_report(json_path=METRICS_JSON_PATH, prom_path=METRICS_PROM_PATH):
+    """
+    Writes the collected stage metrics as JSON and as a Prometheus textfile.
+    Files are written to a temporary name first, so a scraper never reads half a file.
+    """
+    records = get_metrics()
+    outputs = [
+        (json_path, json.dumps({'generated_at': time.time(), 'stages': records}, indent=2)),
+        (prom_path, "\n".join(_prometheus_lines(records)) + "\n"),
+    ]
+    for path, content in outputs:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    print(f"\nMetrics for {len(records)} stages written to {json_path} and {prom_path}.")
@@ -0,0 +1,180 @@
+"""
+Orders partitioned by month, as a Hive-style Parquet dataset:
+
+    <dataset>/order_month=2024-01/part-0.parquet
+    <dataset>/order_month=2024-02/part-0.parquet
+    ...
+
+Orders without a date go to order_month=__HIVE_DEFAULT_PARTITION__ (read back as null
+by pyarrow and DuckDB). Inside a partition the orders are sorted by order_date_time.
+The parse cache keeps one such dataset next to its Arrow files, so:
+
+    - a time window (KPI 4) only reduces the months it overlaps
+    - monthly trends are one small reduction per partition, run in parallel
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pipeline.kpi_engine import kpis_from_customer_totals
+from pipeline.metrics import track_stage
+from pipeline.surrogate_keys import key_positions
+
+# --- CONSTANTS ---
+PARTITION_COLUMN = 'order_month'
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Threads reading/reducing partitions at once (None = ThreadPoolExecutor's default).
+# Parquet decoding and the NumPy reductions release the GIL, so threads are enough.
+PARTITION_WORKERS = None
+
+# The columns the KPIs read from a partition
+KPI_COLUMNS = ['customer_key', 'order_date_time', 'total_amount']
+
+
+def write_orders_dataset(unique_orders_df, dataset_dir):
+    """
+    Writes the orders as one Parquet file per month under 'dataset_dir' (replacing it).
+    The dataset is written next to it and renamed, so readers never see half of it.
+    """
+    tmp_dir = f"{dataset_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        order_times = unique_orders_df['order_date_time']
+        months = order_times.dt.strftime('%Y-%m').fillna(NULL_PARTITION)
+        by_time = np.argsort(order_times.to_numpy(), kind='stable')
+        sorted_df = unique_orders_df.iloc[by_time].reset_index(drop=True)
+        for month, month_df in sorted_df.groupby(months.to_numpy()[by_time], sort=True):
+            partition_dir = os.path.join(tmp_dir, f"{PARTITION_COLUMN}={month}")
+            os.makedirs(partition_dir)
+            month_df.to_parquet(os.path.join(partition_dir, 'part-0.parquet'), index=False)
+        if os.path.isdir(dataset_dir):
+            shutil.rmtree(dataset_dir)
+        os.replace(tmp_dir, dataset_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def list_month_partitions(dataset_dir):
+    """
+    Returns {month ('YYYY-MM', or None for undated orders): Parquet file}, oldest first.
+    """
+    partitions = {}
+    for entry in sorted(os.scandir(dataset_dir), key=lambda entry: entry.name):
+        name, _, month = entry.name.partition('=')
+        if entry.is_dir() and name == PARTITION_COLUMN:
+            partitions[None if month == NULL_PARTITION else month] = os.path.join(entry.path, 'part-0.parquet')
+    return partitions
+
+
+def prune_partitions(partitions, start, end=None):
+    """
+    Keeps the partitions whose month overlaps [start, end] (end=None: no upper bound).
+    Months compare as 'YYYY-MM' strings, so no file is opened to decide.
+    """
+    first_month = pd.Timestamp(start).strftime('%Y-%m')
+    last_month = None if end is None else pd.Timestamp(end).strftime('%Y-%m')
+    return {
+        month: path for month, path in partitions.items()
+        if month is not None and month >= first_month and (last_month is None or month <= last_month)
+    }
+
+
+def orders_dataset(unique_orders_df):
+    """
+    The month-partitioned copy of 'unique_orders_df' in the parse cache, if it has one
+    (load_and_clean_data records it in the frame's attrs), else None.
+    """
+    dataset_dir = unique_orders_df.attrs.get('orders_dataset')
+    return dataset_dir if dataset_dir and os.path.isdir(dataset_dir) else None
+
+
+def _partition_totals(path, customer_keys, since=None):
+    """
+    Reduces one month partition to per-customer order counts and spend, plus the month's
+    order count and revenue. With 'since', also the per-customer counts and spend of the
+    orders from then on.
+    """
+    part_df = pd.read_parquet(path, columns=KPI_COLUMNS)
+    customer_pos = key_positions(customer_keys, part_df['customer_key'])
+    has_customer = customer_pos >= 0
+    amounts = part_df['total_amount'].to_numpy()
+    order_times = part_df['order_date_time'].to_numpy()
+    size = len(customer_keys)
+
+    totals = {
+        'order_count': np.bincount(customer_pos[has_customer], minlength=size),
+        'spend': np.bincount(customer_pos[has_customer], weights=amounts[has_customer], minlength=size),
+        'month_orders': len(part_df),
+        'month_revenue': amounts.sum(),
+    }
+    if since is None:
+        return totals
+    # Rows are sorted by time, so the window is a suffix of the partition
+    window_start = np.searchsorted(order_times, np.datetime64(pd.Timestamp(since)), side='left')
+    in_window = has_customer.copy()
+    in_window[:window_start] = False
+    totals['window_count'] = np.bincount(customer_pos[in_window], minlength=size)
+    totals['window_spend'] = np.bincount(customer_pos[in_window], weights=amounts[in_window], minlength=size)
+    return totals
+
+
+def compute_kpis_partitioned(customers_df, dataset_dir, since, max_workers=PARTITION_WORKERS):
+    """
+    Computes all 4 KPIs from the month-partitioned dataset, one partition per task in a
+    thread pool. Each partition is reduced to per-customer totals (a bincount over the
+    customers' row positions) and its month's totals; the per-customer totals are summed
+    and then grouped by name / region. KPI 4 only looks at partitions overlapping its
+    window. Customers must have unique keys.
+
+    Returns {kpi_name: DataFrame}, identical to kpi_engine.compute_kpis_vectorized.
+    """
+    partitions = list_month_partitions(dataset_dir)
+    window_months = set(prune_partitions(partitions, since))
+    customer_keys = customers_df['customer_key'].to_numpy()
+
+    with track_stage('mem_kpi.partitions', rows_in=len(partitions)):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            totals = dict(zip(partitions, pool.map(
+                lambda item: _partition_totals(item[1], customer_keys, since if item[0] in window_months else None),
+                partitions.items()
+            )))
+
+    size = len(customer_keys)
+
+    def summed(field, months=None):
+        parts = [part[field] for month, part in totals.items() if months is None or month in months]
+        return np.sum(parts, axis=0) if parts else np.zeros(size)
+
+    customer_totals = {
+        'order_count': summed('order_count'),
+        'spend': summed('spend'),
+        'window_count': summed('window_count', window_months),
+        'window_spend': summed('window_spend', window_months),
+    }
+
+    # KPI 2 needs every month from the first to the last order, like resample
+    dated = sorted(month for month in totals if month is not None)
+    month_labels = pd.period_range(dated[0], dated[-1], freq='M').strftime('%Y-%m') if dated else []
+    month_orders = np.array([totals[m]['month_orders'] if m in totals else 0 for m in month_labels], dtype=np.int64)
+    month_revenue = np.array([totals[m]['month_revenue'] if m in totals else 0.0 for m in month_labels])
+
+    with track_stage('mem_kpi.combine', rows_in=size):
+        return kpis_from_customer_totals(customers_df, customer_totals, month_labels, month_orders, month_revenue)
+
+
+def compute_kpis_from_frames(customers_df, unique_orders_df, since, max_workers=PARTITION_WORKERS):
+    """
+    compute_kpis_partitioned for frames: uses the cached month-partitioned copy when there
+    is one, otherwise partitions the orders into a temporary dataset first.
+    """
+    dataset_dir = orders_dataset(unique_orders_df)
+    if dataset_dir is not None:
+        return compute_kpis_partitioned(customers_df, dataset_dir, since, max_workers)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataset_dir = os.path.join(tmp_dir, 'orders_by_month')
+        with track_stage('mem_kpi.partition_orders', rows_in=len(unique_orders_df)):
+            write_orders_dataset(unique_orders_df, dataset_dir)
+        return compute_kpis_partitioned(customers_df, dataset_dir, since, max_workers)
@@ -0,0 +1,134 @@
+import threading
+import numpy as np
+import pandas as pd
+from pipeline.kpi_engine import factorize_sorted
+from pipeline.surrogate_keys import key_positions
+
+
+# Amounts are summed as integer paise (they are rounded to 2 decimals when parsed), so
+# prefix-sum differences are exact and both ways of reducing a window agree to the paisa
+AMOUNT_SCALE = 100
+
+
+class OrdersTimeIndex:
+    """
+    Orders kept sorted by order_date_time, plus per-customer prefix sums of spend, for
+    rolling-window spend queries.
+
+    - Globally the orders are sorted by time, so any [start, end] window is one contiguous
+      slice found with two binary searches.
+    - Per customer the orders are also sorted by time with a running total of spend, so
+      every customer's spend in a window is two binary searches and a subtraction.
+
+    Top-N spenders use whichever is cheaper: a reduction over the window slice when it has
+    fewer orders than there are customers, else the prefix sums (one vectorized binary
+    search per customer). Built once per dataset (O(n log n)); every query after that is
+    O(min(window size, customers * log n)).
+    """
+
+    def __init__(self, customers_df, unique_orders_df):
+        times = unique_orders_df['order_date_time'].to_numpy('datetime64[ns]')
+        has_date = ~np.isnat(times)
+        times = times[has_date].astype(np.int64)
+        amounts = unique_orders_df['total_amount'].to_numpy()[has_date]
+        customer_pos = key_positions(
+            customers_df['customer_key'], unique_orders_df['customer_key'].to_numpy()[has_date]
+        )
+
+        name_codes, self.names = factorize_sorted(customers_df['customer_name'])
+        self.customer_names = name_codes
+        self.amount_dtype = amounts.dtype
+        paise = np.rint(amounts * AMOUNT_SCALE).astype(np.int64)
+
+        # --- Global time order ---
+        by_time = np.argsort(times, kind='stable')
+        self.times = times[by_time]
+        self.paise = paise[by_time]
+        self.order_names = np.where(customer_pos >= 0, name_codes[customer_pos], -1)[by_time]
+
+        # --- Per customer: orders sorted by (customer, time) with running spend ---
+        # The sort key is customer * n + position in time order, so one searchsorted over it
+        # finds where a time window starts inside every customer's run of orders at once
+        n_orders = len(times)
+        time_rank = np.empty(n_orders, dtype=np.int64)
+        time_rank[by_time] = np.arange(n_orders)
+        customer_order_keys = customer_pos.astype(np.int64) * n_orders + time_rank
+        by_customer = np.argsort(customer_order_keys, kind='stable')
+        self.customer_order_keys = customer_order_keys[by_customer]
+        self.customer_cumspend = np.concatenate([[0], np.cumsum(paise[by_customer])])
+
+    @staticmethod
+    def window(window_days=30, as_of=None):
+        """
+        Returns the (start, end) timestamps of a window. With as_of=None it is 'the last
+        window_days up to now' with no upper bound, like KPI 4; otherwise it is
+        [as_of - window_days, as_of], for backfills. end is None when unbounded.
+        """
+        end = pd.Timestamp.now() if as_of is None else pd.Timestamp(as_of)
+        return end - pd.Timedelta(days=window_days), (None if as_of is None else end)
+
+    def top_spenders(self, window_days=30, as_of=None, n=10):
+        """
+        The top 'n' customers by spend in the window, as DataFrame(customer_name, total_spend).
+        With the defaults this is KPI 4.
+        """
+        return self.top_spenders_between(*self.window(window_days, as_of), n=n)
+
+    def _customer_window_totals(self, lo, hi):
+        """
+        Order count and spend (paise) of every customer for the orders at time positions
+        [lo, hi), from the per-customer prefix sums.
+        """
+        customers = np.arange(len(self.customer_names), dtype=np.int64) * len(self.times)
+        starts = np.searchsorted(self.customer_order_keys, customers + lo, side='left')
+        ends = np.searchsorted(self.customer_order_keys, customers + hi, side='left')
+        return ends - starts, self.customer_cumspend[ends] - self.customer_cumspend[starts]
+
+    def top_spenders_between(self, start, end=None, n=10):
+        """
+        Top 'n' spenders for orders with start <= order_date_time <= end (end=None: no upper bound).
+        """
+        lo = np.searchsorted(self.times, pd.Timestamp(start).value, side='left')
+        hi = len(self.times) if end is None else np.searchsorted(self.times, pd.Timestamp(end).value, side='right')
+
+        if hi - lo < len(self.customer_names):
+            # Small window: reduce the window slice
+            names = self.order_names[lo:hi]
+            has_name = names >= 0
+            counts = np.bincount(names[has_name], minlength=len(self.names))
+            spend = np.bincount(names[has_name], weights=self.paise[lo:hi][has_name], minlength=len(self.names))
+        else:
+            # Large window: per-customer totals from the prefix sums, then by name
+            customer_counts, customer_spend = self._customer_window_totals(lo, hi)
+            has_name = self.customer_names >= 0
+            counts = np.bincount(self.customer_names[has_name], weights=customer_counts[has_name],
+                                 minlength=len(self.names))
+            spend = np.bincount(self.customer_names[has_name], weights=customer_spend[has_name],
+                                minlength=len(self.names))
+        present = counts > 0
+
+        top_df = pd.DataFrame({
+            'customer_name': self.names[present],
+            'total_spend': (spend[present] / AMOUNT_SCALE).astype(self.amount_dtype),
+        })
+        return top_df.sort_values(by='total_spend', ascending=False).head(n)
+
+
+# The index for the most recent dataset, reused until the data version changes
+_index_lock = threading.Lock()
+_cached_index = {}
+
+
+def get_orders_index(customers_df, unique_orders_df):
+    """
+    Returns an OrdersTimeIndex for these frames, building it only when the data version
+    (set by load_and_clean_data) changes. Frames without a version are indexed every call.
+    """
+    data_version = (customers_df.attrs.get('data_version'), unique_orders_df.attrs.get('data_version'))
+    if None in data_version:
+        return OrdersTimeIndex(customers_df, unique_orders_df)
+    with _index_lock:
+        if _cached_index.get('version') != data_version:
+            _cached_index['index'] = OrdersTimeIndex(customers_df, unique_orders_df)
+            _cached_index['version'] = data_version
+        return _cached_index['index']
@@ -1,48 +1,162 @@
 import pandas as pd
 from datetime import datetime, timedelta
 import warnings
+from pipeline.kpi_cache import KPI_RESULT_CACHE, KpiResultCache
+from pipeline.kpi_engine import compute_kpis_vectorized
+from pipeline.kpi_sharded import compute_kpis_sharded
+from pipeline.metrics import track_stage
+from pipeline.order_partitions import compute_kpis_from_frames
+from pipeline.orders_index import get_orders_index
+from pipeline.sinks import KPI_TITLES, write_kpis
 
-def run_in_memory_kpi_analysis(customers_df, unique_orders_df):
+
+def thirty_days_before(now=None):
     """
-    Uses Pandas to get all 4 KPIs directly from the DataFrames.
-    (Requirement B2a)
+    Returns the start of the 'last 30 days' window used by KPI 4.
     """
-    print("\n--- Starting Requirement B (In-Memory Approach): Running Pandas KPI Functions ---")
-    
-    merged_df = pd.merge(
-        unique_orders_df,
-        customers_df,
-        on='mobile_number',
-        how='left' 
-    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=UserWarning)
+        return (now or datetime.now()) - timedelta(days=30)
+
+
+def compute_in_memory_kpis(customers_df, unique_orders_df, since=None):
+    """
+    The original pandas implementation: merge once, then one groupby/resample per KPI.
+    'since' is the start of the KPI 4 window (default: 30 days ago).
+    Returns {kpi_name: DataFrame} exactly as the KPIs are printed.
+    """
+    with track_stage('mem_kpi.merge', rows_in=len(unique_orders_df)):
+        merged_df = pd.merge(
+            unique_orders_df,
+            customers_df,
+            on='customer_key',
+            how='left'
+        )
 
     # KPI 1: Repeat Customers
-    print("\nKPI 1: Repeat Customers (Customers with > 1 order)")
-    customer_order_counts = merged_df.groupby('customer_name')['order_id'].count()
-    kpi_1_df = customer_order_counts[customer_order_counts > 1].reset_index(name='order_count')
-    print(kpi_1_df.to_string())
+    with track_stage('mem_kpi.kpi_1', rows_in=len(merged_df)):
+        customer_order_counts = merged_df.groupby('customer_name')['order_id'].count()
+        kpi_1_df = customer_order_counts[customer_order_counts > 1].reset_index(name='order_count')
 
     # KPI 2: Monthly Order Trends
-    print("\nKPI 2: Monthly Order Trends")
-    monthly_df = merged_df.set_index('order_date_time')
-    kpi_2_df = monthly_df.resample('M').agg(
-        total_orders=('order_id', 'count'),
-        total_revenue=('total_amount', 'sum')
-    )
-    kpi_2_df.index = kpi_2_df.index.strftime('%Y-%m')
-    print(kpi_2_df)
+    with track_stage('mem_kpi.kpi_2', rows_in=len(merged_df)):
+        monthly_df = merged_df.set_index('order_date_time')
+        kpi_2_df = monthly_df.resample('M').agg(
+            total_orders=('order_id', 'count'),
+            total_revenue=('total_amount', 'sum')
+        )
+        kpi_2_df.index = kpi_2_df.index.strftime('%Y-%m')
 
     # KPI 3: Regional Revenue
-    print("\nKPI 3: Regional Revenue")
-    kpi_3_df = merged_df.groupby('region')['total_amount'].sum().reset_index(name='total_revenue')
-    print(kpi_3_df.sort_values(by='total_revenue', ascending=False).to_string())
+    with track_stage('mem_kpi.kpi_3', rows_in=len(merged_df)):
+        kpi_3_df = merged_df.groupby('region', observed=True)['total_amount'].sum().reset_index(name='total_revenue')
 
     # KPI 4: Top Customers by Spend (Last 30 Days)
-    print("\nKPI 4: Top Customers (Last 30 Days)")
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=UserWarning)
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-    
-    recent_orders_df = merged_df[merged_df['order_date_time'] >= thirty_days_ago]
-    kpi_4_df = recent_orders_df.groupby('customer_name')['total_amount'].sum().reset_index(name='total_spend')
-    print(kpi_4_df.sort_values(by='total_spend', ascending=False).head(10).to_string())
\ No newline at end of file
+    with track_stage('mem_kpi.kpi_4', rows_in=len(merged_df)):
+        recent_orders_df = merged_df[merged_df['order_date_time'] >= (since or thirty_days_before())]
+        kpi_4_df = recent_orders_df.groupby('customer_name')['total_amount'].sum().reset_index(name='total_spend')
+
+    return {
+        'kpi_1': kpi_1_df,
+        'kpi_2': kpi_2_df,
+        'kpi_3': kpi_3_df.sort_values(by='total_revenue', ascending=False),
+        'kpi_4': kpi_4_df.sort_values(by='total_spend', ascending=False).head(10),
+    }
+
+
+def top_spenders(customers_df, unique_orders_df, window_days=30, as_of=None, n=10, cache=KPI_RESULT_CACHE):
+    """
+    Top 'n' customers by spend over any rolling window, e.g. 7/30/90 days,
+    or [as_of - window_days, as_of] for backfills. With the defaults this is KPI 4.
+
+    Uses the time-sorted orders index (built once per data version), so each call is
+    a binary search plus a reduction over the orders in the window only.
+    Results with a fixed as_of are cached per data version.
+    Returns DataFrame(customer_name, total_spend).
+    """
+    data_version = (customers_df.attrs.get('data_version'), unique_orders_df.attrs.get('data_version'))
+    use_cache = cache is not None and as_of is not None and None not in data_version
+    if use_cache:
+        cache_key = KpiResultCache.make_key(
+            'memory', 'top_spenders',
+            {'window_days': window_days, 'as_of': pd.Timestamp(as_of).isoformat(), 'n': n},
+            data_version
+        )
+        top_df = cache.get(cache_key)
+        if top_df is not None:
+            return top_df
+
+    with track_stage('mem_kpi.top_spenders', rows_in=len(unique_orders_df)) as record:
+        top_df = get_orders_index(customers_df, unique_orders_df).top_spenders(window_days, as_of, n)
+        record['rows_out'] = len(top_df)
+    if use_cache:
+        cache.put(cache_key, top_df)
+    return top_df
+
+
+def _cached_kpis(cache, cache_keys):
+    """
+    Returns every KPI from the cache, or None if any of them is missing.
+    """
+    kpis = {kpi_name: cache.get(key) for kpi_name, key in cache_keys.items()}
+    return kpis if all(kpi_df is not None for kpi_df in kpis.values()) else None
+
+
+def run_in_memory_kpi_analysis(customers_df, unique_orders_df, method='vectorized', cache=KPI_RESULT_CACHE,
+                               sink=None):
+    """
+    Uses Pandas to get all 4 KPIs directly from the DataFrames.
+    (Requirement B2a)
+    method='vectorized' computes every KPI in one pass of NumPy reductions (see kpi_engine);
+    method='pandas' runs the original merge + groupby version; method='partitioned' reduces
+    the month partitions of the orders in parallel (see order_partitions) and method='sharded'
+    splits the orders by customer over one process per core (see kpi_sharded).
+    All give the same results.
+
+    If the frames carry a data version (set by load_and_clean_data), results are cached
+    per version. The KPI 4 window start is then rounded down to the minute, so repeated
+    requests within the same minute share one result. Pass cache=None to always compute.
+    The results are written to 'sink' (see pipeline.sinks; default: stdout).
+    Returns {kpi_name: DataFrame}.
+    """
+    print("\n--- Starting Requirement B (In-Memory Approach): Running Pandas KPI Functions ---")
+
+    if method != 'pandas' and not customers_df['customer_key'].is_unique:
+        # The merge would repeat orders for duplicated customers; only the pandas path does that
+        print("Note: duplicate mobile numbers in customers, using the pandas KPI path.")
+        method = 'pandas'
+
+    since = thirty_days_before()
+    data_version = (customers_df.attrs.get('data_version'), unique_orders_df.attrs.get('data_version'))
+    use_cache = cache is not None and None not in data_version
+
+    kpis = None
+    if use_cache:
+        since = since.replace(second=0, microsecond=0)
+        cache_keys = {
+            kpi_name: KpiResultCache.make_key(
+                'memory', kpi_name,
+                {'window_days': 30, 'since': since.isoformat()} if kpi_name == 'kpi_4' else {},
+                data_version
+            )
+            for kpi_name in KPI_TITLES
+        }
+        kpis = _cached_kpis(cache, cache_keys)
+        if kpis is not None:
+            print(f"Served all KPIs from the cache ({cache.stats()}).")
+
+    if kpis is None:
+        if method == 'vectorized':
+            kpis = compute_kpis_vectorized(customers_df, unique_orders_df, since)
+        elif method == 'partitioned':
+            kpis = compute_kpis_from_frames(customers_df, unique_orders_df, since)
+        elif method == 'sharded':
+            kpis = compute_kpis_sharded(customers_df, unique_orders_df, since)
+        else:
+            kpis = compute_in_memory_kpis(customers_df, unique_orders_df, since)
+        if use_cache:
+            for kpi_name, kpi_df in kpis.items():
+                cache.put(cache_keys[kpi_name], kpi_df)
+
+    write_kpis(kpis, sink)
+    return kpis
@@ -0,0 +1,131 @@
+import contextlib
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pipeline.metrics import track_stage
+
+
+class _StageOutput:
+    """
+    Stands in for sys.stdout while stages run, so concurrent stages don't interleave their
+    output. One stage at a time prints straight through; what the others print is held
+    back and printed as one block when the printing stage finishes. Output of threads that
+    aren't running a stage (e.g. a stage's own worker threads) goes straight through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._buffers = {}      # stage thread -> output held back so far
+        self._finished = []     # held-back output of stages that have already finished
+        self._owner = None      # the stage thread printing straight through
+
+    def write(self, text):
+        thread = threading.get_ident()
+        with self._lock:
+            if thread in self._buffers:
+                if self._owner not in (None, thread):
+                    return self._buffers[thread].write(text)
+                self._owner = thread
+            return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @contextlib.contextmanager
+    def stage(self):
+        """
+        Holds back the output of the calling thread's stage while another stage prints.
+        """
+        thread = threading.get_ident()
+        with self._lock:
+            self._buffers[thread] = io.StringIO()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._finished.append(self._buffers.pop(thread).getvalue())
+                if self._owner in (None, thread):
+                    self._owner = None
+                    self._release()
+            self.stream.flush()
+
+    def _release(self):
+        # Prints the finished stages' blocks, then hands the terminal to a running stage
+        # that has output waiting (printing what it held back so far)
+        for text in self._finished:
+            self.stream.write(text)
+        self._finished.clear()
+        for thread, buffer in self._buffers.items():
+            if buffer.tell():
+                self.stream.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+                self._owner = thread
+                break
+
+
+def run_stage_graph(stages, max_workers=None):
+    """
+    Runs pipeline stages as a small dependency graph.
+
+    'stages' maps a stage name to (func, [dependency names]). A stage starts as soon as
+    all of its dependencies have finished, and func is called with their results
+    (in the order listed). Independent stages run at the same time in a thread pool,
+    so the total run time is about the longest branch instead of the sum of all stages.
+    Their printed output isn't mixed: one stage prints at a time, the others' output is
+    printed as a block once it is their turn (see _StageOutput).
+
+    Returns {stage name: result}. If a stage fails, nothing new is started and the error is re-raised.
+    """
+    for name, (_, dependencies) in stages.items():
+        for dependency in dependencies:
+            if dependency not in stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'.")
+
+    results = {}
+    pending = dict(stages)
+    running = {}
+    run_start = time.perf_counter()
+    output = _StageOutput(sys.stdout)
+
+    def run_stage(name, func, args):
+        with output.stage():
+            with track_stage(name) as record:
+                result = func(*args)
+            print(f"[scheduler] Stage '{name}' finished in {record['wall_seconds']:.2f}s.")
+        return result
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as pool:
+            while pending or running:
+                # Start every stage whose dependencies are all done
+                for name, (func, dependencies) in list(pending.items()):
+                    if all(dependency in results for dependency in dependencies):
+                        args = [results[dependency] for dependency in dependencies]
+                        running[pool.submit(run_stage, name, func, args)] = name
+                        del pending[name]
+
+                if not running:
+                    raise ValueError(f"Stages {sorted(pending)} have circular dependencies.")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except BaseException:
+                        # Let the running stages finish, but don't start any new ones
+                        pending.clear()
+                        raise
+    finally:
+        sys.stdout = output.stream
+
+    print(f"[scheduler] All stages finished in {time.perf_counter() - run_start:.2f}s.")
+    return results
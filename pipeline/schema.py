@@ -0,0 +1,222 @@
+import pandas as pd
+import sqlalchemy
+
+# --- 1. TABLE DEFINITIONS ---
+# The pipeline owns the DDL for its tables instead of letting to_sql guess TEXT/BIGINT columns.
+# '{table}' is filled in with the real name, so the same definition also builds staging tables.
+TABLE_DDL = {
+    # --- Star schema: dimensions and facts joined only on dense integer surrogate keys ---
+    'customer_dim': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            customer_key INT NOT NULL,
+            customer_id VARCHAR(32) NOT NULL,
+            customer_name VARCHAR(255) NOT NULL,
+            mobile_number BIGINT NOT NULL,
+            region VARCHAR(64),
+            PRIMARY KEY (customer_key),
+            UNIQUE KEY uq_customer_dim_mobile_number (mobile_number)
+        )
+    """,
+    'sku_dim': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            sku_key INT NOT NULL,
+            sku_id VARCHAR(32) NOT NULL,
+            PRIMARY KEY (sku_key),
+            UNIQUE KEY uq_sku_dim_sku_id (sku_id)
+        )
+    """,
+    'orders': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            order_key INT NOT NULL,
+            order_id VARCHAR(32) NOT NULL,
+            customer_key INT NOT NULL,
+            order_date_time DATETIME NOT NULL,
+            total_amount DECIMAL(12, 2) NOT NULL,
+            -- Partitioned by month (see PARTITIONED_TABLES), so every unique key must contain
+            -- order_date_time. order_id stays unique on its own: the key store gives it one order_key.
+            PRIMARY KEY (order_key, order_date_time),
+            UNIQUE KEY uq_orders_order_id (order_id, order_date_time),
+            -- KPI 1 and 3 join on customer_key; total_amount makes the lookup index-only
+            KEY idx_orders_customer_key (customer_key, total_amount),
+            -- KPI 2 and 4 scan or range-filter on order_date_time; the extra columns cover both queries
+            KEY idx_orders_order_date_time (order_date_time, customer_key, total_amount)
+        )
+    """,
+    'order_items': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            order_key INT NOT NULL,
+            sku_key INT NOT NULL,
+            sku_count INT NOT NULL,
+            PRIMARY KEY (order_key, sku_key)
+        )
+    """,
+
+    # --- KPI rollups, kept up to date by the loader from newly loaded orders only ---
+    'kpi_customer_rollup': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            customer_key INT NOT NULL,
+            order_count INT NOT NULL,
+            total_spend DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (customer_key),
+            -- KPI 1 reads the customers with more than one order
+            KEY idx_customer_rollup_order_count (order_count, customer_key)
+        )
+    """,
+    'kpi_monthly_rollup': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            order_month CHAR(7) NOT NULL,
+            total_orders INT NOT NULL,
+            total_revenue DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (order_month)
+        )
+    """,
+    'kpi_region_rollup': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            region VARCHAR(64) NOT NULL,
+            total_revenue DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (region)
+        )
+    """,
+    'kpi_customer_daily': """
+        CREATE TABLE IF NOT EXISTS {table} (
+            customer_key INT NOT NULL,
+            order_date DATE NOT NULL,
+            total_spend DECIMAL(16, 2) NOT NULL,
+            PRIMARY KEY (customer_key, order_date),
+            -- KPI 4 reads a date range of daily buckets
+            KEY idx_customer_daily_order_date (order_date, customer_key, total_spend)
+        )
+    """,
+}
+
+# Column definitions start with the column name; key/index lines start with these words
+_NON_COLUMN_WORDS = {'PRIMARY', 'UNIQUE', 'KEY', 'INDEX', 'CREATE', '--'}
+
+ROLLUP_TABLES = ['kpi_customer_rollup', 'kpi_monthly_rollup', 'kpi_region_rollup', 'kpi_customer_daily']
+
+# Tables range-partitioned by month on a DATETIME column. A query with a time window
+# (KPI 4, the rollup deltas) only reads the partitions it overlaps.
+PARTITIONED_TABLES = {'orders': 'order_date_time'}
+
+# The catch-all partition past the last month; new month partitions are split off it
+MAXVALUE_PARTITION = 'pmax'
+
+# Month partitions are created this many months ahead of the newest order, so the
+# catch-all partition stays empty and splitting it never has to move rows
+PARTITION_MONTHS_AHEAD = 1
+
+
+# --- 2. SCHEMA HELPERS ---
+def create_table(conn, base_name, table_name=None):
+    """
+    Creates one managed table (or a staging copy of it called 'table_name').
+    """
+    ddl = TABLE_DDL[base_name].format(table=table_name or base_name).rstrip()
+    if base_name in PARTITIONED_TABLES:
+        # Starts with the catch-all partition only; ensure_month_partitions() adds the months
+        ddl += (f"\n        PARTITION BY RANGE (TO_DAYS({PARTITIONED_TABLES[base_name]})) "
+                f"(PARTITION {MAXVALUE_PARTITION} VALUES LESS THAN MAXVALUE)")
+    conn.execute(sqlalchemy.text(ddl))
+
+
+def month_partition_name(month):
+    """
+    'p202401' for January 2024 ('month' is a pandas Period or Timestamp).
+    """
+    return f"p{month.strftime('%Y%m')}"
+
+
+def get_partition_names(conn, table_name):
+    """
+    The partition names of a table, oldest first (empty if it isn't partitioned).
+    """
+    rows = conn.execute(sqlalchemy.text("""
+        SELECT PARTITION_NAME
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """), {'table_name': table_name}).scalars().all()
+    return list(rows)
+
+
+def ensure_month_partitions(conn, table_name, df, base_name=None):
+    """
+    Makes sure 'table_name' (a managed table, or a staging copy of 'base_name') has a
+    partition for every month of the rows in 'df', up to PARTITION_MONTHS_AHEAD past the
+    newest one, by splitting the missing months off the catch-all partition.
+    Months older than the first partition are left to it. This is DDL, which commits
+    implicitly in MySQL, so call it before the transaction that inserts the rows.
+    Returns the names of the partitions created.
+    """
+    base_name = base_name or table_name
+    if base_name not in PARTITIONED_TABLES:
+        return []
+    order_times = df[PARTITIONED_TABLES[base_name]].dropna()
+    if order_times.empty:
+        return []
+    existing = get_partition_names(conn, table_name)
+    if MAXVALUE_PARTITION not in existing:
+        print(f"Warning: '{table_name}' is not partitioned by month. Run a full load to rebuild it.")
+        return []
+
+    bounded = [name for name in existing if name != MAXVALUE_PARTITION]
+    months = pd.period_range(order_times.min(), order_times.max() + pd.DateOffset(months=PARTITION_MONTHS_AHEAD),
+                             freq='M')
+    # Partition names sort like their months, so only months past the last partition are new
+    new_months = [month for month in months if not bounded or month_partition_name(month) > bounded[-1]]
+    if not new_months:
+        return []
+
+    definitions = ", ".join(
+        f"PARTITION {month_partition_name(month)} VALUES LESS THAN (TO_DAYS('{(month + 1).start_time:%Y-%m-%d}'))"
+        for month in new_months
+    )
+    conn.execute(sqlalchemy.text(
+        f"ALTER TABLE {table_name} REORGANIZE PARTITION {MAXVALUE_PARTITION} INTO "
+        f"({definitions}, PARTITION {MAXVALUE_PARTITION} VALUES LESS THAN MAXVALUE)"
+    ))
+    created = [month_partition_name(month) for month in new_months]
+    print(f"Added {len(created)} month partitions to '{table_name}' ({created[0]} .. {created[-1]}).")
+    return created
+
+
+def table_columns(base_name):
+    """
+    The column names a managed table is defined with.
+    """
+    columns = []
+    for line in TABLE_DDL[base_name].strip().splitlines()[1:-1]:
+        words = line.split()
+        if words and words[0] not in _NON_COLUMN_WORDS:
+            columns.append(words[0])
+    return columns
+
+
+def ensure_schema(engine, rebuild_unmanaged=False):
+    """
+    Makes sure every managed table exists with its keys and indexes.
+    Tables left behind by the old to_sql loader have no primary key, tables from
+    before the star schema miss the surrogate key columns, and an 'orders' table from
+    before month partitioning isn't partitioned; with 'rebuild_unmanaged' they are
+    dropped and recreated (only safe before a full reload).
+    Returns the names of the tables that had to be created.
+    """
+    inspector = sqlalchemy.inspect(engine)
+    created = []
+    with engine.begin() as conn:
+        for base_name in TABLE_DDL:
+            if inspector.has_table(base_name):
+                existing_columns = {column['name'] for column in inspector.get_columns(base_name)}
+                has_primary_key = bool(inspector.get_pk_constraint(base_name)['constrained_columns'])
+                partitioned = (base_name not in PARTITIONED_TABLES
+                               or MAXVALUE_PARTITION in get_partition_names(conn, base_name))
+                if has_primary_key and partitioned and existing_columns >= set(table_columns(base_name)):
+                    continue
+                if not rebuild_unmanaged:
+                    print(f"Warning: '{base_name}' does not match the pipeline schema. Run a full load to rebuild it.")
+                    continue
+                print(f"Rebuilding table '{base_name}' with the pipeline schema.")
+                conn.execute(sqlalchemy.text(f"DROP TABLE {base_name}"))
+            create_table(conn, base_name)
+            created.append(base_name)
+    return created
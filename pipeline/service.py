@@ -0,0 +1,287 @@
+"""
+Long-running in-memory KPI service.
+
+Loads the cleaned DataFrames once, keeps them (and the KPIs that don't depend on
+the clock) resident, and answers KPI requests over local HTTP:
+
+    GET  /health
+    GET  /kpi/repeat_customers
+    GET  /kpi/monthly_trends
+    GET  /kpi/regional_revenue
+    GET  /kpi/top_spenders?window_days=30&as_of=2024-05-01&n=10
+    POST /reload
+
+A watcher thread polls the input files and reloads when they change. A reload builds
+a complete new snapshot on the side and then swaps one reference, so reads never wait
+for it and never see half-loaded data. Requests are handled on one thread each.
+Top spenders results are cached per data version (see pipeline.kpi_cache), so repeated
+requests skip the computation; /health reports the cache hits and misses.
+
+    python -m pipeline.service --port 8080
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from pipeline import CUSTOMER_FILE_PATH, ORDER_FILE_PATH
+from pipeline.data_processor import load_and_clean_data, resolve_order_files
+from pipeline.kpi_cache import KPI_RESULT_CACHE, KpiResultCache
+from pipeline.kpi_engine import compute_kpis_vectorized
+from pipeline.orders_index import OrdersTimeIndex
+from pipeline.pandas_analysis import compute_in_memory_kpis, thirty_days_before
+
+# --- CONSTANTS ---
+# Local only by default; put a reverse proxy in front if it must be reachable from elsewhere
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8080
+# How often (seconds) the watcher checks the input files for changes
+SERVICE_RELOAD_INTERVAL_SECONDS = 5
+
+# URL path -> KPI name in the snapshot
+STATIC_KPI_ROUTES = {
+    '/kpi/repeat_customers': 'kpi_1',
+    '/kpi/monthly_trends': 'kpi_2',
+    '/kpi/regional_revenue': 'kpi_3',
+}
+
+
+def input_signature(customer_file, order_file):
+    """
+    (path, size, mtime) of every input file. Any new, removed or rewritten file changes it.
+    """
+    paths = [customer_file, *resolve_order_files(order_file)]
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class KpiSnapshot:
+    """
+    Everything one version of the data needs to answer requests. Never modified after it is built.
+    """
+
+    def __init__(self, customers_df, unique_orders_df, signature):
+        self.signature = signature
+        self.loaded_at = time.time()
+        self.order_count = len(unique_orders_df)
+        self.data_version = unique_orders_df.attrs.get('data_version')
+
+        # KPIs 1-3 don't depend on the clock, so they are computed once per snapshot
+        if customers_df['customer_key'].is_unique:
+            kpis = compute_kpis_vectorized(customers_df, unique_orders_df, thirty_days_before())
+            self.orders_index = OrdersTimeIndex(customers_df, unique_orders_df)
+        else:
+            print("Note: duplicate mobile numbers in customers, top spenders use the pandas KPI path.")
+            kpis = compute_in_memory_kpis(customers_df, unique_orders_df)
+            self.orders_index = None
+        self.customers_df = customers_df
+        self.unique_orders_df = unique_orders_df
+
+        kpis['kpi_2'] = kpis['kpi_2'].reset_index().rename(columns={'order_date_time': 'order_month'})
+        self.kpi_json = {
+            kpi_name: json.loads(kpi_df.to_json(orient='records'))
+            for kpi_name, kpi_df in kpis.items() if kpi_name != 'kpi_4'
+        }
+
+    def top_spenders(self, window_days=30, as_of=None, n=10, cache=KPI_RESULT_CACHE):
+        # ValueError is answered with 400 (head() would take a negative n as "all but the last")
+        if n < 1:
+            raise ValueError(f"n must be at least 1, got {n}")
+        if not 1 <= window_days < float('inf'):
+            raise ValueError(f"window_days must be at least 1, got {window_days}")
+
+        start, end = OrdersTimeIndex.window(window_days, as_of)
+        if end is None:
+            # Like KPI 4, an open window starts on the minute, so requests within a minute share a result
+            start = start.floor('min')
+        use_cache = cache is not None and self.data_version is not None
+        if use_cache:
+            cache_key = KpiResultCache.make_key(
+                'service', 'top_spenders',
+                {'start': start.isoformat(), 'end': None if end is None else end.isoformat(), 'n': n},
+                self.data_version
+            )
+            rows = cache.get(cache_key)
+            if rows is not None:
+                return rows
+
+        if self.orders_index is not None:
+            top_df = self.orders_index.top_spenders_between(start, end, n)
+        else:
+            order_times = self.unique_orders_df['order_date_time']
+            in_window = (order_times >= start) if end is None else order_times.between(start, end)
+            merged_df = self.unique_orders_df[in_window].merge(self.customers_df, on='customer_key', how='left')
+            top_df = (merged_df.groupby('customer_name')['total_amount'].sum().reset_index(name='total_spend')
+                      .sort_values(by='total_spend', ascending=False).head(n))
+        rows = json.loads(top_df.to_json(orient='records'))
+        if use_cache:
+            cache.put(cache_key, rows)
+        return rows
+
+
+class KpiService:
+    """
+    Holds the current snapshot and reloads it when the input files change.
+    """
+
+    def __init__(self, customer_file=CUSTOMER_FILE_PATH, order_file=ORDER_FILE_PATH,
+                 reload_interval=SERVICE_RELOAD_INTERVAL_SECONDS):
+        self.customer_file = customer_file
+        self.order_file = order_file
+        self.reload_interval = reload_interval
+        self.snapshot = None
+        self._failed_signature = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def reload(self, force=False):
+        """
+        Builds a new snapshot if the inputs changed (or force=True) and swaps it in.
+        Only one reload runs at a time; readers keep using the old snapshot meanwhile.
+        Returns True if a new snapshot was swapped in.
+        """
+        with self._reload_lock:
+            signature = input_signature(self.customer_file, self.order_file)
+            if not force and signature in (getattr(self.snapshot, 'signature', None), self._failed_signature):
+                return False
+            try:
+                customers_df, unique_orders_df, _ = load_and_clean_data(self.customer_file, self.order_file)
+                snapshot = KpiSnapshot(customers_df, unique_orders_df, signature)
+            except (SystemExit, Exception) as e:
+                # load_and_clean_data exits on bad input, and a file still being copied can fail
+                # to parse in many ways; keep serving the current snapshot and try again once the files change
+                print(f"[service] Reload failed ({e.__class__.__name__}: {e}), still serving the previous data.")
+                self._failed_signature = signature
+                return False
+            # Swapping one reference is atomic, so readers see either the old or the new snapshot
+            self.snapshot = snapshot
+            print(f"[service] Loaded {self.snapshot.order_count} orders (version {self.snapshot.data_version}).")
+            return True
+
+    def _watch(self):
+        # The watcher must outlive any one bad check, or hot reload stops for good
+        while not self._stop.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"[service] Checking the input files failed ({e.__class__.__name__}: {e}).")
+
+    def start_watcher(self):
+        watcher = threading.Thread(target=self._watch, name='kpi-service-watcher', daemon=True)
+        watcher.start()
+        return watcher
+
+    def stop(self):
+        self._stop.set()
+
+
+def _make_handler(service):
+
+    class KpiRequestHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            snapshot = service.snapshot  # one read, so the whole request uses one snapshot
+
+            if url.path == '/health':
+                self._send_json(200, {
+                    'status': 'ok',
+                    'orders': snapshot.order_count,
+                    'data_version': snapshot.data_version,
+                    'loaded_at': snapshot.loaded_at,
+                    'kpi_cache': KPI_RESULT_CACHE.stats(),
+                })
+                return
+
+            if url.path in STATIC_KPI_ROUTES:
+                rows = snapshot.kpi_json[STATIC_KPI_ROUTES[url.path]]
+            elif url.path == '/kpi/top_spenders':
+                query = parse_qs(url.query)
+                try:
+                    rows = snapshot.top_spenders(
+                        window_days=float(query.get('window_days', ['30'])[0]),
+                        as_of=query.get('as_of', [None])[0],
+                        n=int(query.get('n', ['10'])[0]),
+                    )
+                except ValueError as e:
+                    self._send_json(400, {'error': f"Bad query parameter: {e}"})
+                    return
+            else:
+                self._send_json(404, {'error': f"Unknown path {url.path}"})
+                return
+
+            self._send_json(200, {
+                'data_version': snapshot.data_version,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+                'rows': rows,
+            })
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/reload':
+                self._send_json(404, {'error': f"Unknown path {self.path}"})
+                return
+            reloaded = service.reload(force=True)
+            self._send_json(200, {'reloaded': reloaded, 'data_version': service.snapshot.data_version})
+
+        def log_message(self, format, *args):
+            # Per-request access logs would dominate the output at high request rates
+            pass
+
+    return KpiRequestHandler
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, customer_file=CUSTOMER_FILE_PATH,
+          order_file=ORDER_FILE_PATH, reload_interval=SERVICE_RELOAD_INTERVAL_SECONDS):
+    """
+    Loads the data once and serves KPI requests until interrupted.
+    """
+    service = KpiService(customer_file, order_file, reload_interval)
+    service.reload(force=True)
+    if service.snapshot is None:
+        print("Error: Could not load the input data, not starting the service.")
+        return
+
+    service.start_watcher()
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    print(f"[service] Serving KPIs on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the in-memory KPIs over local HTTP.")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--customers', default=CUSTOMER_FILE_PATH, help="customer CSV file")
+    parser.add_argument('--orders', default=ORDER_FILE_PATH, help="order XML file, directory or glob")
+    parser.add_argument('--reload-interval', type=float, default=SERVICE_RELOAD_INTERVAL_SECONDS,
+                        help="seconds between input file checks")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.customers, args.orders, args.reload_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Where KPI results go. A sink receives each KPI as a stream of DataFrame chunks, so a
+result with millions of rows is written batch by batch instead of being formatted in
+one piece:
+
+    stdout              print (only the first STDOUT_MAX_ROWS rows of each KPI)
+    csv:<dir>           <dir>/<prefix><kpi>.csv
+    jsonl:<dir>         <dir>/<prefix><kpi>.jsonl, one JSON object per row
+    parquet:<dir>       <dir>/<prefix><kpi>.parquet (needs pyarrow)
+    sql[:<url>]         table <prefix><kpi> in the pipeline database (or the SQLAlchemy URL)
+"""
+import os
+import threading
+
+# --- CONSTANTS ---
+# Rows per chunk when an in-memory result is written to a sink
+SINK_BATCH_ROWS = 50_000
+
+# Formatting huge tables for a terminal is slow and unreadable; the rest is only counted
+STDOUT_MAX_ROWS = 1_000
+
+KPI_TITLES = {
+    'kpi_1': "KPI 1: Repeat Customers (Customers with > 1 order)",
+    'kpi_2': "KPI 2: Monthly Order Trends",
+    'kpi_3': "KPI 3: Regional Revenue",
+    'kpi_4': "KPI 4: Top Customers (Last 30 Days)",
+}
+
+
+class KpiSink:
+    """
+    Base class: write() is called once per chunk (at least once per KPI, maybe with an
+    empty chunk), close() once at the end. Chunks of one KPI arrive in order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows_written = {}
+
+    def write(self, kpi_name, chunk):
+        with self._lock:
+            first = kpi_name not in self.rows_written
+            self.rows_written[kpi_name] = self.rows_written.get(kpi_name, 0) + len(chunk)
+            self._write(kpi_name, chunk, first)
+
+    def _write(self, kpi_name, chunk, first):
+        raise NotImplementedError
+
+    def write_frame(self, kpi_name, kpi_df, batch_rows=SINK_BATCH_ROWS):
+        """
+        Writes an in-memory result in chunks of 'batch_rows'.
+        """
+        for start in range(0, max(len(kpi_df), 1), batch_rows):
+            self.write(kpi_name, kpi_df.iloc[start:start + batch_rows])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _as_table(chunk):
+    # KPI 2 keeps its month in the index; files and tables get it as a column
+    return chunk.reset_index() if chunk.index.name is not None else chunk
+
+
+class StdoutSink(KpiSink):
+    """
+    Prints each KPI under its title, up to 'max_rows' rows.
+    """
+
+    def __init__(self, max_rows=STDOUT_MAX_ROWS):
+        super().__init__()
+        self.max_rows = max_rows
+        self._hidden_rows = {}
+
+    def _write(self, kpi_name, chunk, first):
+        if first:
+            print(f"\n{KPI_TITLES.get(kpi_name, kpi_name)}")
+        already_shown = self.rows_written[kpi_name] - len(chunk)
+        visible = chunk.iloc[:max(self.max_rows - already_shown, 0)]
+        self._hidden_rows[kpi_name] = self._hidden_rows.get(kpi_name, 0) + len(chunk) - len(visible)
+        if first:
+            # The in-memory KPI 2 keeps its month index, so it is printed as-is
+            print(visible if visible.index.name is not None else visible.to_string())
+        elif len(visible):
+            # Streamed chunks each start at row 0; keep numbering the rows across chunks
+            print(visible.set_axis(range(already_shown, already_shown + len(visible))).to_string(header=False))
+
+    def close(self):
+        for kpi_name, hidden_rows in self._hidden_rows.items():
+            if hidden_rows:
+                print(f"({kpi_name}: {hidden_rows} more rows not shown, use a file or table sink)")
+
+
+class _FileSink(KpiSink):
+    extension = None
+
+    def __init__(self, directory, prefix=''):
+        super().__init__()
+        self.directory = directory
+        self.prefix = prefix
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, kpi_name):
+        return os.path.join(self.directory, f"{self.prefix}{kpi_name}.{self.extension}")
+
+
+class CsvSink(_FileSink):
+    extension = 'csv'
+
+    def _write(self, kpi_name, chunk, first):
+        _as_table(chunk).to_csv(self.path(kpi_name), mode='w' if first else 'a', header=first, index=False)
+
+
+class JsonLinesSink(_FileSink):
+    extension = 'jsonl'
+
+    def _write(self, kpi_name, chunk, first):
+        with open(self.path(kpi_name), 'w' if first else 'a') as f:
+            if len(chunk):
+                f.write(_as_table(chunk).to_json(orient='records', lines=True, date_format='iso'))
+                f.write('\n')
+
+
+class ParquetSink(_FileSink):
+    """
+    One Parquet file per KPI, one row group per chunk.
+    """
+    extension = 'parquet'
+
+    def __init__(self, directory, prefix=''):
+        import pyarrow.parquet  # noqa: F401 (fail early if pyarrow is missing)
+
+        super().__init__(directory, prefix)
+        self._writers = {}
+
+    def _write(self, kpi_name, chunk, first):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(_as_table(chunk), preserve_index=False)
+        if first:
+            self._writers[kpi_name] = pq.ParquetWriter(self.path(kpi_name), table.schema)
+        self._writers[kpi_name].write_table(table.cast(self._writers[kpi_name].schema))
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+
+class SqlTableSink(KpiSink):
+    """
+    Writes each KPI into its own table (replaced on the first chunk, appended after that).
+    """
+
+    def __init__(self, engine, prefix='kpi_result_', batch_rows=SINK_BATCH_ROWS):
+        super().__init__()
+        self.engine = engine
+        self.prefix = prefix
+        self.batch_rows = batch_rows
+
+    def _write(self, kpi_name, chunk, first):
+        from pipeline.db_connector import EmbeddedBackend
+
+        if isinstance(self.engine, EmbeddedBackend):
+            # to_sql only takes SQLAlchemy connectables, so the backend writes the table itself
+            self.engine.write_table(f"{self.prefix}{kpi_name}", _as_table(chunk), append=not first)
+            return
+        _as_table(chunk).to_sql(
+            f"{self.prefix}{kpi_name}", self.engine, if_exists='replace' if first else 'append',
+            index=False, method='multi', chunksize=self.batch_rows
+        )
+
+
+def make_sink(spec='stdout', prefix=''):
+    """
+    Builds a sink from a spec like 'stdout', 'csv:out/kpis' or 'sql:sqlite:///kpis.db'
+    (see the module docstring). 'prefix' keeps the results of different runs apart,
+    e.g. 'sql_' and 'mem_'.
+    """
+    kind, _, target = (spec or 'stdout').partition(':')
+    if kind == 'stdout':
+        return StdoutSink()
+    if kind in ('csv', 'jsonl', 'parquet'):
+        if not target:
+            raise ValueError(f"Sink '{kind}' needs a directory, e.g. '{kind}:out/kpis'.")
+        return {'csv': CsvSink, 'jsonl': JsonLinesSink, 'parquet': ParquetSink}[kind](target, prefix)
+    if kind == 'sql':
+        if target:
+            import sqlalchemy
+            engine = sqlalchemy.create_engine(target)
+        else:
+            from pipeline.db_connector import create_db_engine
+            engine = create_db_engine()
+        return SqlTableSink(engine, prefix=f"kpi_result_{prefix}")
+    raise ValueError(f"Unknown sink '{spec}'. Use stdout, csv:<dir>, jsonl:<dir>, parquet:<dir> or sql[:<url>].")
+
+
+def write_kpis(kpis, sink=None):
+    """
+    Writes {kpi_name: DataFrame} to 'sink' (default: stdout) in KPI order and closes it
+    if it was created here.
+    """
+    owned = sink is None
+    sink = sink or StdoutSink()
+    try:
+        for kpi_name, kpi_df in kpis.items():
+            sink.write_frame(kpi_name, kpi_df)
+    finally:
+        if owned:
+            sink.close()
@@ -1,87 +1,723 @@
 import pandas as pd
 import sqlalchemy
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pipeline.db_connector import EmbeddedBackend, run_with_retries
+from pipeline.kpi_cache import KPI_RESULT_CACHE, KpiResultCache
+from pipeline.metrics import track_stage
+from pipeline.pandas_analysis import thirty_days_before
+from pipeline.schema import create_table, ensure_month_partitions, ensure_schema, ROLLUP_TABLES
+from pipeline.sinks import write_kpis
+from pipeline.surrogate_keys import get_sku_dim
 
-def load_data_to_sql(engine, customers_df, unique_orders_df, order_items_df):
+# --- CONSTANTS ---
+# The star schema tables we load, in load order (dimensions first)
+TABLE_NAMES = ['customer_dim', 'sku_dim', 'orders', 'order_items']
+
+# Rows per multi-row INSERT statement in 'bulk' mode
+BULK_INSERT_BATCH_SIZE = 10_000
+
+# Rows fetched per round trip when KPI results are streamed to a sink
+KPI_FETCH_BATCH_SIZE = 50_000
+
+# One-row table that remembers the newest (order_date_time, order_id) we have loaded
+WATERMARK_TABLE = 'etl_watermark'
+
+# One-row counter bumped by every load, so cached KPI results know when they are stale
+DATA_VERSION_TABLE = 'etl_data_version'
+
+
+def _report_load_rate(table_name, row_count, seconds):
+    """
+    Prints (and returns) the rows/sec achieved when loading one table.
+    """
+    rows_per_sec = row_count / seconds if seconds > 0 else float('inf')
+    print(f"Loaded {row_count} rows into '{table_name}' in {seconds:.2f}s ({rows_per_sec:,.0f} rows/sec).")
+    return {'rows': row_count, 'seconds': seconds, 'rows_per_sec': rows_per_sec}
+
+
+def _load_tables_replace(engine, frames):
+    """
+    Empties the live tables and re-inserts the rows with pandas' default inserts.
+    The tables (and their keys and indexes) stay in place. All tables, the rollups, the
+    watermark and the data version are replaced in one transaction, so readers see either
+    the old load or the new one.
+    """
+    with engine.begin() as conn:
+        ensure_month_partitions(conn, 'orders', frames['orders'])
+
+    load_stats = {}
+    with engine.begin() as conn:
+        for table_name, df in frames.items():
+            with track_stage(f'load.{table_name}', rows_in=len(df)) as record:
+                conn.execute(sqlalchemy.text(f"DELETE FROM {table_name}"))
+                df.to_sql(table_name, conn, if_exists='append', index=False)
+                record['rows_out'] = len(df)
+            load_stats[table_name] = _report_load_rate(table_name, len(df), record['wall_seconds'])
+        update_kpi_rollups(conn)
+        _save_watermark(conn, frames['orders'])
+        _bump_data_version(conn)
+    return load_stats
+
+
+def _stage_table(engine, df, table_name, batch_size):
+    """
+    Writes the DataFrame into '<table>_staging' with large multi-row INSERTs.
+    The staging table is built from the managed DDL, so once swapped in it keeps its indexes
+    (and, for 'orders', gets a partition per month of the new data).
+    """
+    staging_name = f"{table_name}_staging"
+    with track_stage(f'load.{table_name}', rows_in=len(df)) as record:
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {staging_name}"))
+            create_table(conn, table_name, staging_name)
+            ensure_month_partitions(conn, staging_name, df, base_name=table_name)
+        df.to_sql(staging_name, engine, if_exists='append', index=False, method='multi', chunksize=batch_size)
+        record['rows_out'] = len(df)
+    return _report_load_rate(table_name, len(df), record['wall_seconds'])
+
+
+def _swap_in_staged_tables(conn, table_names):
+    """
+    Replaces every table in 'table_names' with its '<table>_staging' copy in a single
+    RENAME TABLE, which MySQL performs atomically across all the tables named in it.
+    """
+    for table_name in table_names:
+        conn.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {table_name}_old"))
+    conn.execute(sqlalchemy.text("RENAME TABLE " + ", ".join(
+        f"{table_name} TO {table_name}_old, {table_name}_staging TO {table_name}" for table_name in table_names
+    )))
+    for table_name in table_names:
+        conn.execute(sqlalchemy.text(f"DROP TABLE {table_name}_old"))
+
+
+def _load_tables_bulk(engine, frames, batch_size):
+    """
+    Loads every table into a staging copy in batches of 'batch_size' rows, builds the rollups
+    from the staging copies, and then swaps all of them in at once, so readers never see
+    new orders next to old dimensions or stale rollups (or an empty table).
+    """
+    load_stats = {
+        table_name: _stage_table(engine, df, table_name, batch_size) for table_name, df in frames.items()
+    }
+    with engine.begin() as conn:
+        for table_name in ROLLUP_TABLES:
+            conn.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {table_name}_staging"))
+            create_table(conn, table_name, f"{table_name}_staging")
+    with engine.begin() as conn:
+        update_kpi_rollups(conn, table_suffix='_staging')
+
+    # RENAME TABLE commits implicitly, so the watermark and data version follow right after
+    with engine.begin() as conn:
+        _swap_in_staged_tables(conn, [*frames, *ROLLUP_TABLES])
+    with engine.begin() as conn:
+        _save_watermark(conn, frames['orders'])
+        _bump_data_version(conn)
+    return load_stats
+
+
+def load_data_to_sql(engine, customers_df, unique_orders_df, order_items_df,
+                     mode='replace', batch_size=BULK_INSERT_BATCH_SIZE):
     """
     Loads the clean DataFrames into MySQL tables.
     This is the 'Load' step of ETL. (Requirement A1b)
+    The frames carry surrogate keys (see data_processor.add_surrogate_keys); customers
+    go to 'customer_dim' and the SKU dimension is read from the key store.
+
+    mode='replace' uses pandas' default inserts straight into the live tables, in one transaction.
+    mode='bulk' loads staging tables in batches of 'batch_size' rows and swaps them all in atomically.
+    Returns the rows/sec stats per table so the two modes can be compared.
     """
-    print("\n--- Starting Requirement A (Database Approach): Loading Data ---")
+    print(f"\n--- Starting Requirement A (Database Approach): Loading Data (mode='{mode}') ---")
+    if mode not in ('replace', 'bulk'):
+        print(f"Error: Unknown load mode '{mode}'. Use 'replace' or 'bulk'.")
+        return {}
+
+    frames = dict(zip(TABLE_NAMES, [customers_df, get_sku_dim(), unique_orders_df, order_items_df]))
+    load_stats = {}
     try:
-        customers_df.to_sql('customers', engine, if_exists='replace', index=False)
-        print("Loaded data into 'customers' table.")
-        
-        unique_orders_df.to_sql('orders', engine, if_exists='replace', index=False)
-        print("Loaded data into 'orders' table.")
-        
-        order_items_df.to_sql('order_items', engine, if_exists='replace', index=False)
-        print("Loaded data into 'order_items' table.")
-        
+        # A full reload may replace tables created by the old to_sql loader
+        ensure_schema(engine, rebuild_unmanaged=True)
+        if mode == 'bulk':
+            load_stats = _load_tables_bulk(engine, frames, batch_size)
+        else:
+            load_stats = _load_tables_replace(engine, frames)
+
         print("All data successfully loaded into MySQL.")
     except Exception as e:
         print(f"Error loading data to SQL: {e}")
+    return load_stats
+
+
+# --- KPI ROLLUPS ---
+# Each statement aggregates the orders matching {delta} and adds the result onto the rollup row.
+# {suffix} is appended to every table name ('_staging' builds the rollups of a staged load).
+ROLLUP_UPDATES = [
+    """
+    INSERT INTO kpi_customer_rollup{suffix} (customer_key, order_count, total_spend)
+    SELECT o.customer_key, COUNT(*), SUM(o.total_amount)
+    FROM orders{suffix} o
+    WHERE {delta}
+    GROUP BY o.customer_key
+    ON DUPLICATE KEY UPDATE
+        order_count = order_count + VALUES(order_count),
+        total_spend = total_spend + VALUES(total_spend)
+    """,
+    """
+    INSERT INTO kpi_monthly_rollup{suffix} (order_month, total_orders, total_revenue)
+    SELECT DATE_FORMAT(o.order_date_time, '%Y-%m'), COUNT(*), SUM(o.total_amount)
+    FROM orders{suffix} o
+    WHERE {delta}
+    GROUP BY DATE_FORMAT(o.order_date_time, '%Y-%m')
+    ON DUPLICATE KEY UPDATE
+        total_orders = total_orders + VALUES(total_orders),
+        total_revenue = total_revenue + VALUES(total_revenue)
+    """,
+    """
+    INSERT INTO kpi_region_rollup{suffix} (region, total_revenue)
+    SELECT c.region, SUM(o.total_amount)
+    FROM orders{suffix} o
+    JOIN customer_dim{suffix} c ON o.customer_key = c.customer_key
+    WHERE {delta} AND c.region IS NOT NULL
+    GROUP BY c.region
+    ON DUPLICATE KEY UPDATE
+        total_revenue = total_revenue + VALUES(total_revenue)
+    """,
+    """
+    INSERT INTO kpi_customer_daily{suffix} (customer_key, order_date, total_spend)
+    SELECT o.customer_key, DATE(o.order_date_time), SUM(o.total_amount)
+    FROM orders{suffix} o
+    WHERE {delta}
+    GROUP BY o.customer_key, DATE(o.order_date_time)
+    ON DUPLICATE KEY UPDATE
+        total_spend = total_spend + VALUES(total_spend)
+    """,
+]
+
+
+def update_kpi_rollups(conn, since=None, table_suffix=''):
+    """
+    Adds the orders loaded after the 'since' watermark onto the KPI rollup tables.
+    With since=None the rollups are emptied and rebuilt from every order.
+    Runs inside the caller's transaction, so rollups and orders always agree.
+    With 'table_suffix' (e.g. '_staging') it reads and writes those copies of the tables.
+    Note: regional revenue is attributed to the customer's region at load time.
+    """
+    if since is None:
+        for table_name in ROLLUP_TABLES:
+            conn.execute(sqlalchemy.text(f"DELETE FROM {table_name}{table_suffix}"))
+        delta, params = "1 = 1", {}
+    else:
+        delta = ("(o.order_date_time > :since_ts "
+                 "OR (o.order_date_time = :since_ts AND o.order_id > :since_order_id))")
+        params = {'since_ts': since[0].to_pydatetime(), 'since_order_id': since[1]}
+
+    with track_stage('load.kpi_rollups'):
+        for statement in ROLLUP_UPDATES:
+            conn.execute(sqlalchemy.text(statement.format(delta=delta, suffix=table_suffix)), params)
+    print("KPI rollup tables updated." if since is not None else "KPI rollup tables rebuilt.")
+
+
+# --- INCREMENTAL LOADING ---
+
+def get_watermark(engine):
+    """
+    Returns the (order_date_time, order_id) high-water mark of the last load,
+    or None if nothing has been loaded yet.
+    """
+    if not sqlalchemy.inspect(engine).has_table(WATERMARK_TABLE):
+        return None
+    with engine.connect() as conn:
+        row = conn.execute(sqlalchemy.text(
+            f"SELECT order_date_time, order_id FROM {WATERMARK_TABLE} WHERE id = 1"
+        )).fetchone()
+    if row is None:
+        return None
+    return pd.Timestamp(row.order_date_time), row.order_id
+
+
+def _save_watermark(conn, unique_orders_df):
+    """
+    Moves the high-water mark to the newest order in 'unique_orders_df' (inside the caller's transaction).
+    """
+    if unique_orders_df.empty:
+        return
+    newest = unique_orders_df.sort_values(['order_date_time', 'order_id']).iloc[-1]
+
+    conn.execute(sqlalchemy.text(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            id TINYINT PRIMARY KEY,
+            order_date_time DATETIME NOT NULL,
+            order_id VARCHAR(64) NOT NULL
+        )
+    """))
+    conn.execute(
+        sqlalchemy.text(f"REPLACE INTO {WATERMARK_TABLE} (id, order_date_time, order_id) VALUES (1, :ts, :order_id)"),
+        {'ts': newest['order_date_time'].to_pydatetime(), 'order_id': str(newest['order_id'])}
+    )
+    print(f"Watermark moved to {newest['order_date_time']} / {newest['order_id']}.")
+
+
+def get_data_version(engine):
+    """
+    Returns the current data version (0 if nothing has been loaded yet).
+    """
+    if not sqlalchemy.inspect(engine).has_table(DATA_VERSION_TABLE):
+        return 0
+    with engine.connect() as conn:
+        version = conn.execute(sqlalchemy.text(
+            f"SELECT data_version FROM {DATA_VERSION_TABLE} WHERE id = 1"
+        )).scalar()
+    return version or 0
+
+
+def _bump_data_version(conn):
+    """
+    Increments the data version (inside the caller's transaction).
+    """
+    conn.execute(sqlalchemy.text(f"""
+        CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} (
+            id TINYINT PRIMARY KEY,
+            data_version BIGINT NOT NULL
+        )
+    """))
+    conn.execute(sqlalchemy.text(f"""
+        INSERT INTO {DATA_VERSION_TABLE} (id, data_version) VALUES (1, 1)
+        ON DUPLICATE KEY UPDATE data_version = data_version + 1
+    """))
+
+
+def _upsert_dimension(engine, table_name, df, key_column, batch_size):
+    """
+    Upserts a dimension table by its surrogate key: changed rows are replaced and new rows inserted.
+    Unchanged rows are left alone.
+    """
+    staging_name = f"{table_name}_staging"
+    columns = list(df.columns)
+    column_list = ", ".join(columns)
+    # '<=>' is MySQL's NULL-safe equals
+    unchanged = " AND ".join(f"d.{col} <=> s.{col}" for col in columns)
+
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {staging_name}"))
+        create_table(conn, table_name, staging_name)
+    df.to_sql(staging_name, engine, if_exists='append', index=False, method='multi', chunksize=batch_size)
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f"""
+            DELETE d FROM {table_name} d
+            JOIN {staging_name} s ON d.{key_column} = s.{key_column}
+            WHERE NOT ({unchanged})
+        """))
+        result = conn.execute(sqlalchemy.text(f"""
+            INSERT INTO {table_name} ({column_list})
+            SELECT {", ".join(f"s.{col}" for col in columns)}
+            FROM {staging_name} s
+            LEFT JOIN {table_name} d ON d.{key_column} = s.{key_column}
+            WHERE d.{key_column} IS NULL
+        """))
+        conn.execute(sqlalchemy.text(f"DROP TABLE {staging_name}"))
+    print(f"Upserted {result.rowcount} new or changed rows into '{table_name}'.")
+
+
+def load_incremental_to_sql(engine, customers_df, new_orders_df, new_order_items_df,
+                            batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Incremental 'Load' step: upserts the dimensions and appends only the orders past the watermark.
+    The orders, their items and the new watermark are committed in one transaction.
+    Falls back to a full bulk load when nothing has been loaded yet.
+    """
+    print("\n--- Starting Requirement A (Database Approach): Incremental Load ---")
+    watermark = get_watermark(engine)
+    if watermark is None:
+        print("No watermark found, running a full bulk load instead.")
+        return load_data_to_sql(engine, customers_df, new_orders_df, new_order_items_df,
+                                mode='bulk', batch_size=batch_size)
+
+    load_stats = {}
+    try:
+        created_tables = ensure_schema(engine)
+        # Rollup tables that didn't exist yet must be built from the full history
+        rollup_since = None if set(created_tables) & set(ROLLUP_TABLES) else watermark
+        dimensions = [('customer_dim', customers_df, 'customer_key'), ('sku_dim', get_sku_dim(), 'sku_key')]
+        for table_name, df, key_column in dimensions:
+            with track_stage(f'load.{table_name}', rows_in=len(df)) as record:
+                _upsert_dimension(engine, table_name, df, key_column, batch_size)
+            load_stats[table_name] = _report_load_rate(table_name, len(df), record['wall_seconds'])
+
+        # New months need their partition before the insert (outside its transaction: DDL commits)
+        with engine.begin() as conn:
+            ensure_month_partitions(conn, 'orders', new_orders_df)
+        with engine.begin() as conn:
+            for table_name, df in [('orders', new_orders_df), ('order_items', new_order_items_df)]:
+                with track_stage(f'load.{table_name}', rows_in=len(df)) as record:
+                    df.to_sql(table_name, conn, if_exists='append', index=False,
+                              method='multi', chunksize=batch_size)
+                    record['rows_out'] = len(df)
+                load_stats[table_name] = _report_load_rate(table_name, len(df), record['wall_seconds'])
+            update_kpi_rollups(conn, since=rollup_since)
+            _save_watermark(conn, new_orders_df)
+            _bump_data_version(conn)
+
+        print("Incremental load complete.")
+    except Exception as e:
+        print(f"Error loading data to SQL: {e}")
+    return load_stats
+
+
+# --- KPI QUERIES ---
+# Title and SQL for each KPI, kept in one place so they can also be EXPLAINed.
+# KPI_QUERIES aggregate the base tables; ROLLUP_KPI_QUERIES read the rollup tables.
+# The SQL is portable: time windows are bound parameters (:since), and the one
+# dialect-specific expression (month of a timestamp) is filled in by get_kpi_queries().
+KPI_QUERIES = {
+    'kpi_1': ("KPI 1: Repeat Customers (Customers with > 1 order)", """
+        SELECT c.customer_name, c.mobile_number, COUNT(*) AS order_count
+        FROM orders o
+        JOIN customer_dim c ON o.customer_key = c.customer_key
+        GROUP BY c.customer_key, c.customer_name, c.mobile_number
+        HAVING COUNT(*) > 1
+    """),
+    'kpi_2': ("KPI 2: Monthly Order Trends", """
+        SELECT 
+            {order_month} AS order_month,
+            COUNT(*) AS total_orders,
+            SUM(total_amount) AS total_revenue
+        FROM orders
+        GROUP BY order_month
+        ORDER BY order_month
+    """),
+    'kpi_3': ("KPI 3: Regional Revenue", """
+        SELECT 
+            c.region,
+            SUM(o.total_amount) AS total_revenue
+        FROM orders o
+        JOIN customer_dim c ON o.customer_key = c.customer_key
+        GROUP BY c.region
+        ORDER BY total_revenue DESC
+    """),
+    'kpi_4': ("KPI 4: Top Customers (Last 30 Days)", """
+        SELECT 
+            c.customer_name,
+            SUM(o.total_amount) AS total_spend
+        FROM orders o
+        JOIN customer_dim c ON o.customer_key = c.customer_key
+        WHERE o.order_date_time >= :since
+        GROUP BY c.customer_name
+        ORDER BY total_spend DESC
+        LIMIT 10
+    """),
+}
+
+ROLLUP_KPI_QUERIES = {
+    'kpi_1': (KPI_QUERIES['kpi_1'][0], """
+        SELECT c.customer_name, c.mobile_number, r.order_count
+        FROM kpi_customer_rollup r
+        JOIN customer_dim c ON r.customer_key = c.customer_key
+        WHERE r.order_count > 1
+    """),
+    'kpi_2': (KPI_QUERIES['kpi_2'][0], """
+        SELECT order_month, total_orders, total_revenue
+        FROM kpi_monthly_rollup
+        ORDER BY order_month
+    """),
+    'kpi_3': (KPI_QUERIES['kpi_3'][0], """
+        SELECT region, total_revenue
+        FROM kpi_region_rollup
+        ORDER BY total_revenue DESC
+    """),
+    # Daily buckets: the window starts at midnight 30 days ago (:since_date)
+    'kpi_4': (KPI_QUERIES['kpi_4'][0], """
+        SELECT 
+            c.customer_name,
+            SUM(d.total_spend) AS total_spend
+        FROM kpi_customer_daily d
+        JOIN customer_dim c ON d.customer_key = c.customer_key
+        WHERE d.order_date >= :since_date
+        GROUP BY c.customer_name
+        ORDER BY total_spend DESC
+        LIMIT 10
+    """),
+}
+
+# "YYYY-MM" of order_date_time in each SQL dialect
+MONTH_EXPRESSIONS = {
+    'mysql': "DATE_FORMAT(order_date_time, '%Y-%m')",
+    'duckdb': "strftime(order_date_time, '%Y-%m')",
+    'sqlite': "strftime('%Y-%m', order_date_time)",
+}
+
+
+def get_kpi_queries(dialect='mysql', use_rollups=False):
+    """
+    Returns {kpi_name: (title, sql)} for one SQL dialect.
+    The rollup queries read tables that only the MySQL loaders maintain.
+    """
+    queries = ROLLUP_KPI_QUERIES if use_rollups else KPI_QUERIES
+    month_expression = MONTH_EXPRESSIONS[dialect]
+    # Only KPI 2 has a placeholder; the others may contain '%' or braces that format() would eat
+    return {
+        kpi_name: (title, sql.replace('{order_month}', month_expression))
+        for kpi_name, (title, sql) in queries.items()
+    }
+
+
+# KPI 4 for any window: [start_date, end_date] over the daily buckets (both bound parameters)
+TOP_SPENDERS_QUERY = """
+    SELECT 
+        c.customer_name,
+        SUM(d.total_spend) AS total_spend
+    FROM kpi_customer_daily d
+    JOIN customer_dim c ON d.customer_key = c.customer_key
+    WHERE d.order_date BETWEEN :start_date AND :end_date
+    GROUP BY c.customer_name
+    ORDER BY total_spend DESC
+    LIMIT :n
+"""
+
+# KPI 1 has one row per repeat customer, so it is streamed in pages: each page starts after
+# the last customer_key of the previous one (keyset paging, an index range scan per page).
+# The mysqlconnector driver has no server-side cursors, so stream_results would still
+# buffer the whole result. The other KPIs have one row per month/region or a LIMIT.
+KEYSET_KPI_QUERIES = {
+    'kpi_1': {
+        False: """
+            SELECT o.customer_key, c.customer_name, c.mobile_number, COUNT(*) AS order_count
+            FROM orders o
+            JOIN customer_dim c ON o.customer_key = c.customer_key
+            WHERE o.customer_key > :after_key
+            GROUP BY o.customer_key, c.customer_name, c.mobile_number
+            HAVING COUNT(*) > 1
+            ORDER BY o.customer_key
+            LIMIT :batch_size
+        """,
+        True: """
+            SELECT r.customer_key, c.customer_name, c.mobile_number, r.order_count
+            FROM kpi_customer_rollup r
+            JOIN customer_dim c ON r.customer_key = c.customer_key
+            WHERE r.order_count > 1 AND r.customer_key > :after_key
+            ORDER BY r.customer_key
+            LIMIT :batch_size
+        """,
+    },
+}
+
+# Large tables (and their query aliases) that must never be read with a full scan. The
+# customer rollup has a row per customer; the monthly and region rollups stay tiny.
+FACT_TABLES = {'orders', 'o', 'kpi_customer_daily', 'd', 'kpi_customer_rollup', 'r'}
+
+
+def _run_kpi_query(engine, kpi_name, sql, params=None):
+    """
+    Runs one KPI query on its own pooled connection (retrying dropped connections),
+    or in-process on an embedded backend. Returns the result and how long it took.
+    """
+    def query():
+        if isinstance(engine, EmbeddedBackend):
+            return engine.query(sql, params)
+        with engine.connect() as conn:
+            return pd.read_sql(sqlalchemy.text(sql), conn, params=params)
+
+    with track_stage(f'sql_kpi.{kpi_name}') as record:
+        kpi_df = run_with_retries(query)
+        record['rows_out'] = len(kpi_df)
+    return kpi_df, record['wall_seconds']
+
+
+def _kpi_params(kpi_name, use_rollups):
+    """
+    The bound parameters of a KPI query, which are also part of its cache key.
+    KPI 4's window moves with the clock: the rollup version counts whole days, the raw
+    version starts 30 days ago, rounded down to the minute so it can be cached briefly.
+    """
+    if kpi_name != 'kpi_4':
+        return {}
+    if use_rollups:
+        return {'since_date': date.today() - timedelta(days=30)}
+    return {'since': thirty_days_before().replace(second=0, microsecond=0)}
 
-def run_sql_kpi_queries(engine):
+
+def register_kpi_tables(backend, customers_df, unique_orders_df):
+    """
+    Makes the frames queryable on an embedded backend under the MySQL table names.
+    The KPI queries only read 'customer_dim' and 'orders'.
+    """
+    with track_stage('load.register', rows_in=len(customers_df) + len(unique_orders_df)):
+        backend.register('customer_dim', customers_df)
+        backend.register('orders', unique_orders_df)
+    print(f"Registered customer_dim and orders with the embedded '{backend.dialect}' backend.")
+
+
+def query_top_spenders(engine, window_days=30, as_of=None, n=10, cache=KPI_RESULT_CACHE):
+    """
+    Top 'n' customers by spend over any rolling window of whole days, from the
+    kpi_customer_daily rollup (a range read on its order_date index, not a scan of 'orders').
+    as_of is the last day of the window (default: today, with no upper bound, like KPI 4).
+    Returns DataFrame(customer_name, total_spend).
+    """
+    end_date = date.max if as_of is None else pd.Timestamp(as_of).date()
+    start_date = (date.today() if as_of is None else end_date) - timedelta(days=window_days)
+    params = {'start_date': start_date, 'end_date': end_date, 'n': int(n)}
+
+    cache_key = None
+    if cache is not None:
+        cache_key = KpiResultCache.make_key(
+            'sql_rollup', 'top_spenders',
+            {key: str(value) for key, value in params.items()}, get_data_version(engine)
+        )
+        top_df = cache.get(cache_key)
+        if top_df is not None:
+            return top_df
+
+    def query():
+        with engine.connect() as conn:
+            return pd.read_sql(sqlalchemy.text(TOP_SPENDERS_QUERY), conn, params=params)
+
+    with track_stage('sql_kpi.top_spenders') as record:
+        top_df = run_with_retries(query)
+        record['rows_out'] = len(top_df)
+    if cache is not None:
+        cache.put(cache_key, top_df)
+    return top_df
+
+
+def run_sql_kpi_queries(engine, use_rollups=True, max_workers=None, cache=KPI_RESULT_CACHE, sink=None):
     """
     Runs SQL queries against the database to get all 4 KPIs.
     (Requirement A2a, A2b)
+    With use_rollups=True they read the pre-aggregated rollup tables instead of scanning 'orders'.
+    'engine' can also be an EmbeddedBackend (DuckDB / SQLite), which always runs the base queries.
+    The queries run at the same time in a thread pool, each on its own pooled connection,
+    so the wall time is roughly the slowest query instead of the sum of all four.
+    Results are cached per data version; pass cache=None to always query.
+    The results are written to 'sink' (see pipeline.sinks; default: stdout).
+    Returns {kpi_name: DataFrame}.
     """
     print("\n--- Requirement A (Database Approach): Running SQL KPI Queries ---")
-    
+    if isinstance(engine, EmbeddedBackend):
+        dialect, use_rollups, data_version = engine.dialect, False, engine.data_version
+        if data_version is None:
+            cache = None
+    else:
+        dialect, data_version = 'mysql', None
+    queries = get_kpi_queries(dialect, use_rollups)
+    params = {kpi_name: _kpi_params(kpi_name, use_rollups) for kpi_name in queries}
+    source = 'sql_rollup' if use_rollups else f'sql_{dialect}'
+
+    # Serve what we can from the cache; only the misses go to the database
+    results = {}
+    latencies = {}
+    cache_keys = {}
+    if cache is not None:
+        data_version = data_version or get_data_version(engine)
+        for kpi_name in queries:
+            cache_keys[kpi_name] = KpiResultCache.make_key(source, kpi_name, params[kpi_name], data_version)
+            cached_df = cache.get(cache_keys[kpi_name])
+            if cached_df is not None:
+                results[kpi_name], latencies[kpi_name] = cached_df, 0.0
+
+    start = time.perf_counter()
+    missing = [kpi_name for kpi_name in queries if kpi_name not in results]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers or len(missing)) as pool:
+            futures = {
+                kpi_name: pool.submit(_run_kpi_query, engine, kpi_name, queries[kpi_name][1], params[kpi_name])
+                for kpi_name in missing
+            }
+        for kpi_name, future in futures.items():
+            results[kpi_name], latencies[kpi_name] = future.result()
+            if cache is not None:
+                cache.put(cache_keys[kpi_name], results[kpi_name])
+    wall_seconds = time.perf_counter() - start
+
+    # Write in the usual KPI order once everything has finished
+    write_kpis({kpi_name: results[kpi_name] for kpi_name in queries}, sink)
+
+    print("\nSQL KPI latency breakdown:")
+    for kpi_name in queries:
+        cached = " (cached)" if kpi_name not in missing else ""
+        print(f"  {kpi_name}: {latencies[kpi_name] * 1000:.1f} ms{cached}")
+    print(f"  total wall time: {wall_seconds * 1000:.1f} ms")
+    if cache is not None:
+        print(f"  KPI cache: {cache.stats()}")
+    return {kpi_name: results[kpi_name] for kpi_name in queries}
+
+
+def _keyset_pages(conn, sql, params, batch_size):
+    """
+    Yields the result of a KEYSET_KPI_QUERIES query page by page (without the paging key).
+    """
+    after_key = 0
+    while True:
+        page = pd.read_sql(
+            sqlalchemy.text(sql), conn, params={**params, 'after_key': after_key, 'batch_size': batch_size}
+        )
+        if page.empty:
+            return
+        after_key = int(page['customer_key'].iloc[-1])
+        yield page.drop(columns='customer_key')
+        if len(page) < batch_size:
+            return
+
+
+def stream_sql_kpi_queries(engine, sink, use_rollups=True, batch_size=KPI_FETCH_BATCH_SIZE):
+    """
+    Like run_sql_kpi_queries, but for results too big to hold in memory: each KPI goes to
+    'sink' in batches of at most 'batch_size' rows (on MySQL, KPI 1 is read in keyset pages,
+    see KEYSET_KPI_QUERIES). The queries run one after another so only one batch is in
+    memory at a time, and nothing is cached. Returns {kpi_name: rows written}.
+    """
+    print("\n--- Requirement A (Database Approach): Streaming SQL KPI Queries ---")
+    if isinstance(engine, EmbeddedBackend):
+        dialect, use_rollups = engine.dialect, False
+    else:
+        dialect = 'mysql'
+    queries = get_kpi_queries(dialect, use_rollups)
+
+    for kpi_name, (_, sql) in queries.items():
+        params = _kpi_params(kpi_name, use_rollups)
+        with track_stage(f'sql_kpi.{kpi_name}') as record:
+            if isinstance(engine, EmbeddedBackend):
+                for chunk in engine.query_chunks(sql, params, batch_size):
+                    sink.write(kpi_name, chunk)
+            elif kpi_name in KEYSET_KPI_QUERIES:
+                # One connection (and so one transaction snapshot) for all pages, so a load
+                # that finishes meanwhile cannot mix old and new rows
+                with engine.connect() as conn:
+                    for chunk in _keyset_pages(conn, KEYSET_KPI_QUERIES[kpi_name][use_rollups], params, batch_size):
+                        sink.write(kpi_name, chunk)
+            else:
+                with engine.connect() as conn:
+                    sink.write(kpi_name, pd.read_sql(sqlalchemy.text(sql), conn, params=params))
+            # An empty result yields no chunk; the sink still gets the KPI (e.g. a header row)
+            if kpi_name not in sink.rows_written:
+                sink.write(kpi_name, pd.DataFrame())
+            record['rows_out'] = sink.rows_written[kpi_name]
+        print(f"{kpi_name}: {sink.rows_written[kpi_name]} rows written")
+    return dict(sink.rows_written)
+
+
+def check_kpi_index_usage(engine, use_rollups=True):
+    """
+    Runs EXPLAIN on every KPI query and checks that the large tables are read through an index.
+    Prints the access plan per table and returns {kpi_name: True/False}.
+    """
+    print("\n--- Checking KPI query plans (EXPLAIN) ---")
+    queries = get_kpi_queries('mysql', use_rollups)
+    results = {}
     with engine.connect() as conn:
-        
-        # KPI 1: Repeat Customers
-        print("\nKPI 1: Repeat Customers (Customers with > 1 order)")
-        sql_kpi_1 = sqlalchemy.text("""
-            SELECT c.customer_name, c.mobile_number, COUNT(o.order_id) AS order_count
-            FROM orders o
-            JOIN customers c ON o.mobile_number = c.mobile_number
-            GROUP BY c.customer_name, c.mobile_number
-            HAVING order_count > 1;
-        """)
-        kpi_1_df = pd.read_sql(sql_kpi_1, conn)
-        print(kpi_1_df.to_string())
-
-        # KPI 2: Monthly Order Trends
-        print("\nKPI 2: Monthly Order Trends")
-        sql_kpi_2 = sqlalchemy.text("""
-            SELECT 
-                DATE_FORMAT(order_date_time, '%Y-%m') AS order_month,
-                COUNT(order_id) AS total_orders,
-                SUM(total_amount) AS total_revenue
-            FROM orders
-            GROUP BY order_month
-            ORDER BY order_month;
-        """)
-        kpi_2_df = pd.read_sql(sql_kpi_2, conn)
-        print(kpi_2_df.to_string())
-
-        # KPI 3: Regional Revenue
-        print("\nKPI 3: Regional Revenue")
-        sql_kpi_3 = sqlalchemy.text("""
-            SELECT 
-                c.region,
-                SUM(o.total_amount) AS total_revenue
-            FROM orders o
-            JOIN customers c ON o.mobile_number = c.mobile_number
-            GROUP BY c.region
-            ORDER BY total_revenue DESC;
-        """)
-        kpi_3_df = pd.read_sql(sql_kpi_3, conn)
-        print(kpi_3_df.to_string())
-
-        # KPI 4: Top Customers by Spend (Last 30 Days)
-        print("\nKPI 4: Top Customers (Last 30 Days)")
-        sql_kpi_4 = sqlalchemy.text("""
-            SELECT 
-                c.customer_name,
-                SUM(o.total_amount) AS total_spend
-            FROM orders o
-            JOIN customers c ON o.mobile_number = c.mobile_number
-            WHERE o.order_date_time >= DATE_SUB(NOW(), INTERVAL 30 DAY)
-            GROUP BY c.customer_name
-            ORDER BY total_spend DESC
-            LIMIT 10;
-        """)
-        kpi_4_df = pd.read_sql(sql_kpi_4, conn)
-        print(kpi_4_df.to_string())
\ No newline at end of file
+        for kpi_name, (title, sql) in queries.items():
+            plan = conn.execute(
+                sqlalchemy.text(f"EXPLAIN {sql}"), _kpi_params(kpi_name, use_rollups)
+            ).mappings().all()
+            results[kpi_name] = True
+            for step in plan:
+                # 'partitions' lists the month partitions read after pruning
+                print(f"{kpi_name}: table={step['table']} partitions={step.get('partitions')} "
+                      f"type={step['type']} key={step['key']}")
+                if step['table'] in FACT_TABLES and step['key'] is None:
+                    results[kpi_name] = False
+
+            if not results[kpi_name]:
+                print(f"Warning: {title} does a full scan of a large table.")
+    return results
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+import uuid
+import numpy as np
+import pandas as pd
+
+# --- CONSTANTS ---
+# Where the surrogate key assignments are kept between runs (env PIPELINE_KEY_STORE).
+# Unlike the parse cache this is state: deleting it renumbers everything, so the next
+# load must be a full one.
+KEY_STORE_DIR = os.getenv("PIPELINE_KEY_STORE", 'state/surrogate_keys')
+KEY_STORE_FILE = 'keys.sqlite'
+
+# Natural key -> surrogate key table per kind, indexed on the natural key so a run only
+# looks up the keys of its own extract instead of reading the whole history
+KEY_KINDS = {
+    'customer': ('mobile_number', 'int64'),
+    'order': ('order_id', 'str'),
+    'sku': ('sku_id', 'str'),
+}
+SQLITE_TYPES = {'int64': 'INTEGER', 'str': 'TEXT'}
+
+# Surrogate keys are dense, so 32 bits hold ~2 billion customers/orders/SKUs
+KEY_DTYPE = 'int32'
+
+# One process writes the key store (the loader); this guards threads inside it
+_key_store_lock = threading.Lock()
+
+
+def _connect(key_dir):
+    os.makedirs(key_dir, exist_ok=True)
+    # Autocommit mode, so transactions are only the explicit BEGIN ... COMMIT blocks below
+    conn = sqlite3.connect(os.path.join(key_dir, KEY_STORE_FILE), isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("CREATE TABLE IF NOT EXISTS store_info (store_id TEXT NOT NULL)")
+    for kind, (_, dtype) in KEY_KINDS.items():
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {kind}_keys ("
+            f"natural_key {SQLITE_TYPES[dtype]} PRIMARY KEY, surrogate_key INTEGER NOT NULL UNIQUE)"
+        )
+    return conn
+
+
+def key_store_id(key_dir=KEY_STORE_DIR):
+    """
+    A random id created with the key store. Results that contain surrogate keys (e.g. the
+    parse cache) are tied to it, so they are not reused if the store is deleted and rebuilt.
+    """
+    with _key_store_lock:
+        conn = _connect(key_dir)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT store_id FROM store_info").fetchone()
+            if row is None:
+                row = (uuid.uuid4().hex,)
+                conn.execute("INSERT INTO store_info (store_id) VALUES (?)", row)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+    return row[0]
+
+
+def load_key_map(kind, key_dir=KEY_STORE_DIR):
+    """
+    Returns the natural keys of 'kind' as an Index, in surrogate key order (key = position + 1).
+    """
+    column, dtype = KEY_KINDS[kind]
+    with _key_store_lock:
+        conn = _connect(key_dir)
+        try:
+            rows = conn.execute(f"SELECT natural_key FROM {kind}_keys ORDER BY surrogate_key").fetchall()
+        finally:
+            conn.close()
+    return pd.Index([row[0] for row in rows], dtype=dtype, name=column)
+
+
+def _lookup_or_add_keys(conn, kind, natural_keys):
+    """
+    Surrogate keys of 'natural_keys' (a list of unique values), giving the ones not in the
+    store yet the next free keys. Only these values are read, not the whole table.
+    """
+    keys = np.zeros(len(natural_keys), dtype=KEY_DTYPE)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (position INTEGER PRIMARY KEY, natural_key)")
+        conn.execute("DELETE FROM lookup")
+        conn.executemany("INSERT INTO lookup (position, natural_key) VALUES (?, ?)", enumerate(natural_keys))
+        known = np.array(conn.execute(
+            f"SELECT l.position, k.surrogate_key FROM lookup l JOIN {kind}_keys k ON k.natural_key = l.natural_key"
+        ).fetchall(), dtype=np.int64).reshape(-1, 2)
+        keys[known[:, 0]] = known[:, 1]
+
+        # New values are numbered in the order they appear, after the current largest key
+        new_positions = np.flatnonzero(keys == 0)
+        if len(new_positions):
+            next_key = conn.execute(f"SELECT COALESCE(MAX(surrogate_key), 0) + 1 FROM {kind}_keys").fetchone()[0]
+            keys[new_positions] = np.arange(next_key, next_key + len(new_positions))
+            conn.executemany(
+                f"INSERT INTO {kind}_keys (natural_key, surrogate_key) VALUES (?, ?)",
+                ((natural_keys[position], int(keys[position])) for position in new_positions),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return keys
+
+
+def assign_surrogate_keys(kind, values, key_dir=KEY_STORE_DIR):
+    """
+    Maps natural keys (a Series of mobile numbers, order ids or SKU ids) to dense integer
+    surrogate keys. Values seen in earlier runs keep their key; new values get the next
+    free keys, which are added to the key store. Returns an int32 array like 'values'.
+    Missing values have no key and raise ValueError (data_quality quarantines them first).
+    """
+    column, dtype = KEY_KINDS[kind]
+    if values.isna().any():
+        raise ValueError(f"{values.isna().sum()} {column} values are missing and cannot get a surrogate key.")
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Key the (few) categories once, then gather by code (no code is -1, checked above)
+        category_keys = assign_surrogate_keys(kind, values.cat.categories.to_series(), key_dir)
+        return category_keys[values.cat.codes.to_numpy()]
+
+    values = values.astype(dtype)
+    uniques = pd.Index(pd.unique(values))
+    with _key_store_lock:
+        conn = _connect(key_dir)
+        try:
+            unique_keys = _lookup_or_add_keys(conn, kind, uniques.tolist())
+        finally:
+            conn.close()
+    return unique_keys[uniques.get_indexer(values)]
+
+
+def get_sku_dim(key_dir=KEY_STORE_DIR):
+    """
+    The SKU dimension: DataFrame(sku_key, sku_id) of every SKU seen so far.
+    """
+    sku_ids = load_key_map('sku', key_dir)
+    return pd.DataFrame({
+        'sku_key': np.arange(1, len(sku_ids) + 1, dtype=KEY_DTYPE),
+        'sku_id': sku_ids,
+    })
+
+
+def key_positions(keys, lookup_keys):
+    """
+    Row position of each of 'lookup_keys' in 'keys' (-1 if absent), e.g. the customer row
+    of every order. Dense keys allow a plain array lookup instead of a hash join.
+    'keys' must be unique.
+    """
+    keys = np.asarray(keys)
+    lookup_keys = np.asarray(lookup_keys)
+    size = int(max(keys.max(initial=0), lookup_keys.max(initial=0))) + 1
+    position_of_key = np.full(size, -1, dtype=np.int64)
+    position_of_key[keys] = np.arange(len(keys))
+    return position_of_key[lookup_keys]